@@ -23,14 +23,36 @@ class CountryAdmin(admin.ModelAdmin):
 @admin.register(State)
 class StateAdmin(admin.ModelAdmin):
     search_fields = ('name', 'code')
+    list_select_related = ('country',)
 
 
 @admin.register(Locality)
 class LocalityAdmin(admin.ModelAdmin):
     search_fields = ('name', 'postal_code')
+    list_select_related = ('state__country',)
 
 
 @admin.register(Address)
 class AddressAdmin(admin.ModelAdmin):
-    search_fields = ('name',)
+    search_fields = ('display', 'raw')
     list_filter = (UnidentifiedListFilter,)
+
+
+@admin.register(CachedGeocode)
+class CachedGeocodeAdmin(admin.ModelAdmin):
+    list_display = ('query', 'latitude', 'longitude', 'updated')
+    search_fields = ('query',)
+
+
+@admin.register(Region)
+class RegionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'kind', 'updated')
+    list_filter = ('kind',)
+    search_fields = ('name',)
+
+
+@admin.register(CellDensity)
+class CellDensityAdmin(admin.ModelAdmin):
+    list_display = ('cell', 'length', 'addresses', 'owned')
+    list_filter = ('length',)
+    search_fields = ('=cell',)
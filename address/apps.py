@@ -1,4 +1,7 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class AddressConfig(AppConfig):
@@ -7,3 +10,36 @@ class AddressConfig(AppConfig):
     """
     name = 'address'
     verbose_name = "Address"
+
+    def ready(self):
+        from .cache import hierarchy_cache
+        from .signals import (
+            invalidate_address, invalidate_addresses, invalidate_hierarchy, remember_labels, update_density,
+            update_labels, update_locality_index,
+        )
+
+        for model in ('Country', 'State', 'Locality'):
+            model = self.get_model(model)
+            post_save.connect(invalidate_hierarchy, sender=model, dispatch_uid='address_hierarchy_save_%s' % model.__name__)
+            post_delete.connect(invalidate_hierarchy, sender=model, dispatch_uid='address_hierarchy_delete_%s' % model.__name__)
+            post_save.connect(invalidate_addresses, sender=model, dispatch_uid='address_cache_save_%s' % model.__name__)
+            post_delete.connect(invalidate_addresses, sender=model, dispatch_uid='address_cache_delete_%s' % model.__name__)
+            pre_save.connect(remember_labels, sender=model, dispatch_uid='address_labels_pre_save_%s' % model.__name__)
+            post_save.connect(update_labels, sender=model, dispatch_uid='address_labels_save_%s' % model.__name__)
+
+        address = self.get_model('Address')
+        post_save.connect(invalidate_address, sender=address, dispatch_uid='address_cache_save')
+        post_delete.connect(invalidate_address, sender=address, dispatch_uid='address_cache_delete')
+        post_delete.connect(update_density, sender=address, dispatch_uid='address_density_delete')
+
+        for model in ('State', 'Locality'):
+            model = self.get_model(model)
+            post_save.connect(update_locality_index, sender=model, dispatch_uid='address_parser_save_%s' % model.__name__)
+            post_delete.connect(update_locality_index, sender=model, dispatch_uid='address_parser_delete_%s' % model.__name__)
+
+        if getattr(settings, 'ADDRESS_HIERARCHY_WARMUP', False):
+            try:
+                hierarchy_cache.warm()
+            except DatabaseError:
+                # Tables not migrated yet; the cache fills up as it is used.
+                pass
@@ -0,0 +1,264 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .normalize import normalize_address
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['GeocodeCache', 'geocode_cache', 'normalize_query', 'HierarchyCache', 'hierarchy_cache',
+           'AddressCache', 'address_cache']
+
+GEOCODE_CACHE_SIZE = getattr(settings, 'ADDRESS_GEOCODE_CACHE_SIZE', 2048)
+GEOCODE_CACHE_TTL = getattr(settings, 'ADDRESS_GEOCODE_CACHE_TTL', 60 * 60 * 24 * 30)
+GEOCODE_CACHE_NEGATIVE_TTL = getattr(settings, 'ADDRESS_GEOCODE_CACHE_NEGATIVE_TTL', 60 * 60 * 24)
+HIERARCHY_CACHE_SIZE = getattr(settings, 'ADDRESS_HIERARCHY_CACHE_SIZE', 10000)
+ADDRESS_CACHE = getattr(settings, 'ADDRESS_CACHE', 'default')
+ADDRESS_CACHE_TIMEOUT = getattr(settings, 'ADDRESS_CACHE_TIMEOUT', 60 * 60)
+ADDRESS_CACHE_VERSION = getattr(settings, 'ADDRESS_CACHE_VERSION', 1)
+
+# Returned by `GeocodeCache.get` when nothing usable is cached, so that a
+# cached negative result (`None`) can be told apart from a miss.
+MISS = object()
+
+
+def normalize_query(query):
+    """Returns the cache key for a geocoding query string."""
+    return normalize_address(query)
+
+
+def _db_key(key, max_length=255):
+    # Very long queries are truncated and suffixed with a digest so they
+    # still fit the `CachedGeocode.query` column without colliding.
+    if len(key) <= max_length:
+        return key
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return key[:max_length - len(digest) - 1] + '#' + digest
+
+##
+# Two tier cache of geocoding results: a bounded in-process LRU in front
+# of the `CachedGeocode` table. Values are `(latitude, longitude)` tuples,
+# or `None` when the geocoder could not find the query.
+##
+
+
+class GeocodeCache(object):
+
+    def __init__(self, maxsize=GEOCODE_CACHE_SIZE, ttl=GEOCODE_CACHE_TTL,
+                 negative_ttl=GEOCODE_CACHE_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _expired(self, value, stored):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        return stored < timezone.now() - timedelta(seconds=ttl)
+
+    def _remember(self, key, value, stored):
+        with self._lock:
+            self._data[key] = (value, stored)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, query):
+        """Returns the cached value for `query`, or `MISS`."""
+        key = normalize_query(query)
+        if not key:
+            return MISS
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if not self._expired(*entry):
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._data[key]
+
+        from .models import CachedGeocode
+        try:
+            row = CachedGeocode.objects.get(query=_db_key(key))
+        except CachedGeocode.DoesNotExist:
+            row = None
+        if row is not None:
+            value = row.value()
+            if not self._expired(value, row.updated):
+                self._remember(key, value, row.updated)
+                self.db_hits += 1
+                return value
+
+        self.misses += 1
+        return MISS
+
+    def set(self, query, value):
+        key = normalize_query(query)
+        if not key:
+            return
+        from .models import CachedGeocode
+        latitude, longitude = value if value is not None else (None, None)
+        row, _ = CachedGeocode.objects.update_or_create(
+            query=_db_key(key),
+            defaults=dict(latitude=latitude, longitude=longitude, updated=timezone.now())
+        )
+        self._remember(key, value, row.updated)
+
+    def clear(self):
+        """Empties the in-process tier and resets the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.db_hits = self.misses = 0
+
+    def stats(self):
+        return dict(hits=self.hits, db_hits=self.db_hits, misses=self.misses, size=len(self._data))
+
+
+geocode_cache = GeocodeCache()
+
+##
+# Maps the natural keys used by `_to_python` to primary keys for countries
+# (name), states (name, country) and localities (name, postal code, state).
+# Entries are dropped by the `post_save`/`post_delete` receivers in
+# `address.signals`.
+##
+
+
+class HierarchyCache(object):
+
+    def __init__(self, maxsize=HIERARCHY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._keys = {}
+        self._pks = {}
+        self._lock = threading.Lock()
+
+    def get(self, model, *key):
+        return self._keys.get((model, key))
+
+    def set(self, model, pk, *key):
+        """Caches `pk` once the current transaction commits, so rows that end
+        up rolled back are never handed out."""
+        if pk is None:
+            return
+        transaction.on_commit(lambda: self._set(model, pk, key))
+
+    def _set(self, model, pk, key):
+        with self._lock:
+            if len(self._keys) >= self.maxsize:
+                self._keys.clear()
+                self._pks.clear()
+            self._keys[(model, key)] = pk
+            self._pks[(model, pk)] = key
+
+    def invalidate(self, model, pk):
+        with self._lock:
+            key = self._pks.pop((model, pk), None)
+            if key is not None:
+                self._keys.pop((model, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self._pks.clear()
+
+    def warm(self):
+        """Loads every country and state."""
+        from .models import Country, State
+        for pk, name in Country.objects.values_list('pk', 'name'):
+            self._set(Country, pk, (name,))
+        for pk, name, country_id in State.objects.values_list('pk', 'name', 'country_id'):
+            self._set(State, pk, (name, country_id))
+
+
+hierarchy_cache = HierarchyCache()
+
+##
+# `Address.as_dict()` payloads by primary key, in one of Django's caches.
+# Saving or deleting an address drops its entry; changes to countries,
+# states or localities bump a generation counter stored next to the
+# entries, which makes all of them stale. Changing `ADDRESS_CACHE_VERSION`
+# flushes everything, e.g. on deploys that change the payload.
+##
+
+
+class AddressCache(object):
+
+    generation_key = 'address:generation'
+
+    def __init__(self, alias=ADDRESS_CACHE, timeout=ADDRESS_CACHE_TIMEOUT, version=ADDRESS_CACHE_VERSION):
+        self.alias = alias
+        self.timeout = timeout
+        self.version = version
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, pk):
+        return 'address:%s' % pk
+
+    def get(self, pk):
+        """Returns the `as_dict()` of the address `pk`, loading and caching
+        it on a miss. Raises `Address.DoesNotExist` for unknown addresses."""
+        from .models import Address
+
+        key = self.key(pk)
+        found = self.cache.get_many([self.generation_key, key], version=self.version)
+        generation = found.get(self.generation_key)
+        if generation is None:
+            generation = self._seed()
+        entry = found.get(key)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+
+        payload = Address.objects.with_hierarchy().get(pk=pk).as_dict()
+        self.cache.set(key, (generation, payload), self.timeout, version=self.version)
+        return payload
+
+    def invalidate(self, *pks):
+        """Drops the entries of the addresses `pks`, now and once the
+        current transaction commits, so a read racing the write can't keep
+        the old values."""
+        keys = [self.key(pk) for pk in pks]
+        if keys:
+            self._now_and_on_commit(lambda: self.cache.delete_many(keys, version=self.version))
+
+    def _seed(self):
+        # Starts the generation counter from the clock, in milliseconds, so
+        # after an eviction it doesn't restart at a value older entries may
+        # carry. Returns the generation in use.
+        generation = int(time.time() * 1000)
+        if not self.cache.add(self.generation_key, generation, None, version=self.version):
+            generation = self.cache.get(self.generation_key, generation, version=self.version)
+        return generation
+
+    def _bump(self):
+        try:
+            self.cache.incr(self.generation_key, version=self.version)
+        except ValueError:
+            self._seed()
+
+    def bump(self):
+        """Makes every cached address stale, now and once the current
+        transaction commits."""
+        self._now_and_on_commit(self._bump)
+
+    def _now_and_on_commit(self, func):
+        func()
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(func)
+
+
+address_cache = AddressCache()
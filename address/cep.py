@@ -0,0 +1,195 @@
+"""
+Offline index of Brazilian postal codes (CEPs).
+
+The index is a single binary file: a small header, the sorted CEPs as
+little-endian unsigned ints and one fixed-width record per CEP. It is opened
+with `mmap`, so every process serving the site shares the same pages, and a
+lookup is a binary search over the key block.
+"""
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['CepRecord', 'CepIndex', 'build_index', 'lookup_cep', 'clean_cep']
+
+MAGIC = b'CEPIDX1\0'
+HEADER = struct.Struct('<8sI')
+KEY = struct.Struct('<I')
+RECORD = struct.Struct('<80s40s40s2sff')
+
+CepRecord = namedtuple('CepRecord', 'cep street neigh city state latitude longitude')
+
+_non_digits_re = re.compile(r'[^0-9]')
+
+
+def clean_cep(value):
+    """Returns `value` as an 8 digit CEP string, or '' if it isn't one."""
+    value = _non_digits_re.sub('', value or '')
+    return value if len(value) == 8 else ''
+
+
+def _encode(value, size):
+    data = (value or '').encode('utf-8')[:size]
+    # Don't leave half of a multi-byte character at the end.
+    return data.decode('utf-8', 'ignore').encode('utf-8')
+
+
+def _decode(data):
+    return data.rstrip(b'\0').decode('utf-8')
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def build_index(rows, path):
+    """Writes an index of `rows` to `path` and returns the number of CEPs.
+
+    `rows` yields `CepRecord`s (or tuples in the same order). Invalid CEPs are
+    skipped and the last row wins for duplicated ones. The file is written
+    next to `path` and moved into place, so processes that have the old
+    index mapped keep working.
+    """
+    records = {}
+    for row in rows:
+        row = CepRecord(*row)
+        cep = clean_cep(row.cep)
+        if cep:
+            records[int(cep)] = row
+    keys = sorted(records)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(keys)))
+            for key in keys:
+                f.write(KEY.pack(key))
+            for key in keys:
+                row = records[key]
+                f.write(RECORD.pack(
+                    _encode(row.street, 80),
+                    _encode(row.neigh, 40),
+                    _encode(row.city, 40),
+                    _encode(row.state, 2),
+                    _float(row.latitude),
+                    _float(row.longitude),
+                ))
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return len(keys)
+
+##
+# A read-only, memory-mapped view of an index file.
+##
+
+
+class CepIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError('%s is not a CEP index' % path)
+        self._keys = HEADER.size
+        self._records = self._keys + self.count * KEY.size
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._mm.close()
+
+    def _find(self, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = KEY.unpack_from(self._mm, self._keys + mid * KEY.size)[0]
+            if value < key:
+                lo = mid + 1
+            elif value > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def lookup(self, cep):
+        """Returns the `CepRecord` for `cep`, or `None`."""
+        cep = clean_cep(cep)
+        if not cep:
+            return None
+        pos = self._find(int(cep))
+        if pos < 0:
+            return None
+        street, neigh, city, state, lat, lng = RECORD.unpack_from(
+            self._mm, self._records + pos * RECORD.size)
+        return CepRecord(
+            cep, _decode(street), _decode(neigh), _decode(city), _decode(state),
+            None if math.isnan(lat) else lat,
+            None if math.isnan(lng) else lng,
+        )
+
+
+_index = None
+_index_lock = threading.Lock()
+# `(path, mtime)` of an index file that could not be opened, mtime being
+# None when it didn't exist.
+_failed = None
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def get_index():
+    """Returns the index configured by `ADDRESS_CEP_INDEX`, or `None`.
+
+    A file that can't be opened is logged once and tried again only after
+    it appears or changes.
+    """
+    global _index, _failed
+    path = getattr(settings, 'ADDRESS_CEP_INDEX', None)
+    if not path:
+        return None
+    with _index_lock:
+        if _index is None or _index.path != path:
+            failure = (path, _mtime(path))
+            if failure == _failed:
+                return None
+            try:
+                _index = CepIndex(path)
+            except (IOError, OSError, ValueError) as e:
+                logger.error('Unable to open CEP index %s: %s', path, e)
+                _failed = failure
+                return None
+            _failed = None
+        return _index
+
+
+def lookup_cep(cep):
+    """Looks `cep` up in the configured index. Returns a `CepRecord` or `None`."""
+    index = get_index()
+    if index is None:
+        return None
+    return index.lookup(cep)
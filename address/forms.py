@@ -12,6 +12,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
+from .cep import lookup_cep
 from .models import Address, to_python
 from .widgets import AddressWidget
 
@@ -62,6 +63,19 @@ class AddressForm(forms.ModelForm):
                                     )
                                     )
 
+    def clean(self):
+        cleaned_data = super(AddressForm, self).clean()
+
+        # Complete whatever the user left blank from the CEP index.
+        record = lookup_cep(cleaned_data.get('zip_code'))
+        if record:
+            for field, value in (('route', record.street), ('neigh', record.neigh),
+                                 ('city', record.city), ('state', record.state)):
+                if value and not cleaned_data.get(field):
+                    cleaned_data[field] = value
+                    self.errors.pop(field, None)
+        return cleaned_data
+
     class Meta:
         model = Address
         fields = ['zip_code', 'street_number', 'extra', 'route', 'neigh', 'city', 'state']
@@ -106,8 +120,7 @@ class AddressWidget(forms.TextInput):
         elif isinstance(value, dict):
             ad = value
         elif isinstance(value, (int, long)):
-            ad = Address.objects.get(pk=value)
-            ad = ad.as_dict()
+            ad = Address.objects.get_cached(value)
         else:
             ad = value.as_dict()
 
@@ -0,0 +1,221 @@
+"""
+A process-wide Nominatim client.
+
+All geocoding goes through one `GeocoderClient`, which reuses pooled
+keep-alive connections and protects the provider (and our own latency) with
+a token bucket rate limiter, a concurrency cap, a per-call time budget and a
+circuit breaker that fails fast while the provider is down.
+"""
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from geopy.exc import GeocoderQueryError, GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable
+from geopy.geocoders import Nominatim
+
+try:
+    from geopy.adapters import RequestsAdapter
+except ImportError:
+    RequestsAdapter = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['TokenBucket', 'CircuitBreaker', 'CircuitOpenError', 'GeocoderClient', 'make_client', 'get_client']
+
+DEFAULTS = {
+    'DOMAIN': 'nominatim.openstreetmap.org',
+    'SCHEME': 'https',
+    'USER_AGENT': 'cpm',
+    'TIMEOUT': 5.0,             # seconds allowed per call, waiting included
+    'RATE': 1.0,                # requests per second
+    'BURST': 1,
+    'MAX_CONCURRENCY': 4,
+    'FAILURE_THRESHOLD': 5,     # consecutive errors that open the circuit
+    'RESET_TIMEOUT': 30.0,      # seconds before a probe is let through
+    'BACKEND': 'nominatim',     # or 'record' / 'replay' with a CASSETTE
+    'CASSETTE': None,
+    'LATENCY': 0,               # replay only: seconds per call,
+    'JITTER': 0,                # plus up to this much more,
+    'ERROR_RATE': 0,            # and the fraction of calls that time out
+}
+
+
+class CircuitOpenError(GeocoderUnavailable):
+    pass
+
+##
+# A token bucket: `rate` tokens per second, holding up to `capacity`.
+##
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """Takes a token, waiting at most `timeout` seconds. Returns success."""
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining < wait:
+                    return False
+            time.sleep(wait)
+
+##
+# Opens after `threshold` consecutive failures. Once `reset_timeout` has
+# passed a single probe call is allowed (half-open); its outcome closes or
+# re-opens the circuit.
+##
+
+
+class CircuitBreaker(object):
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold, reset_timeout, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._clock = clock
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # A probe that never reported back doesn't keep the circuit
+            # half-open forever; another one is let through after a while.
+            if self._clock() - self._opened >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._opened = self._clock()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    logger.warning('Geocoder circuit opened after %d failures', self.failures)
+                self.state = self.OPEN
+                self._opened = self._clock()
+
+
+class GeocoderClient(object):
+
+    def __init__(self, **options):
+        config = dict(DEFAULTS, **options)
+        self.config = config
+        self.timeout = config['TIMEOUT']
+        kwargs = {}
+        if RequestsAdapter is not None and RequestsAdapter.is_available:
+            kwargs['adapter_factory'] = functools.partial(
+                RequestsAdapter,
+                pool_connections=1,
+                pool_maxsize=config['MAX_CONCURRENCY'],
+                max_retries=0,
+            )
+        self.geocoder = Nominatim(
+            domain=config['DOMAIN'],
+            scheme=config['SCHEME'],
+            user_agent=config['USER_AGENT'],
+            timeout=self.timeout,
+            **kwargs
+        )
+        self.bucket = TokenBucket(config['RATE'], config['BURST'])
+        self.breaker = CircuitBreaker(config['FAILURE_THRESHOLD'], config['RESET_TIMEOUT'])
+        self.slots = threading.BoundedSemaphore(config['MAX_CONCURRENCY'])
+
+    def geocode(self, query, timeout=None, **kwargs):
+        """Geocodes `query` with Nominatim, within `timeout` seconds overall.
+
+        Raises `CircuitOpenError` while the provider is considered down and
+        `GeocoderTimedOut` when the budget runs out while waiting for a
+        connection slot or a rate limiter token.
+        """
+        budget = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + budget
+
+        if not self.breaker.allow():
+            raise CircuitOpenError('Geocoder circuit is open')
+
+        if not self.slots.acquire(timeout=budget):
+            raise GeocoderTimedOut('No geocoder connection available within %ss' % budget)
+        try:
+            if not self.bucket.acquire(timeout=deadline - time.monotonic()):
+                raise GeocoderTimedOut('Geocoder rate limit exceeded the %ss budget' % budget)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise GeocoderTimedOut('Geocoder budget of %ss exhausted' % budget)
+            try:
+                result = self.geocoder.geocode(query, timeout=remaining, **kwargs)
+            except GeocoderQueryError:
+                # The provider answered, it just didn't like the query.
+                self.breaker.record_success()
+                raise
+            except GeocoderServiceError:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            return result
+        finally:
+            self.slots.release()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def make_client(**options):
+    """Builds the client for the configured `BACKEND`."""
+    from .backends import RecordingGeocoder, ReplayGeocoder
+
+    config = dict(DEFAULTS, **options)
+    backend = config['BACKEND']
+    if backend == 'nominatim':
+        return GeocoderClient(**config)
+    if not config['CASSETTE']:
+        raise ImproperlyConfigured('The %s geocoder backend needs a CASSETTE' % backend)
+    if backend == 'record':
+        return RecordingGeocoder(GeocoderClient(**config), config['CASSETTE'])
+    if backend == 'replay':
+        return ReplayGeocoder(config['CASSETTE'], latency=config['LATENCY'],
+                              jitter=config['JITTER'], error_rate=config['ERROR_RATE'])
+    raise ImproperlyConfigured('Unknown geocoder backend: %s' % backend)
+
+
+def get_client():
+    """Returns the shared client, configured from `ADDRESS_GEOCODER`."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = make_client(**getattr(settings, 'ADDRESS_GEOCODER', {}))
+        return _client
@@ -0,0 +1,112 @@
+"""
+Geohash cells of address coordinates.
+
+A geohash names a cell of a grid over latitude and longitude with a base 32
+string; each extra character splits the cell into 32, and the cells inside
+a cell share its geohash as a prefix. `Address.geohash` stores the finest
+cell (`LENGTH` characters) of each address, so the addresses in a cell of
+any precision are a prefix range scan of its btree index.
+
+    length  cell size (at the equator)
+    4       39km x 19.5km
+    5       4.9km x 4.9km
+    6       1.2km x 0.6km
+    7       153m x 153m
+    8       38m x 19m
+"""
+__all__ = ['LENGTH', 'encode', 'bounds', 'neighbours', 'merge_cells']
+
+# Characters stored per address; about 3.7cm x 1.9cm.
+LENGTH = 12
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = dict((c, i) for i, c in enumerate(BASE32))
+
+
+def encode(latitude, longitude, length=LENGTH):
+    """Returns the geohash of `length` characters of the cell containing
+    the coordinates, or an empty string if either is None."""
+    if latitude is None or longitude is None:
+        return ''
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    cell = []
+    bits = value = 0
+    even = True
+    while len(cell) < length:
+        if even:
+            middle = (west + east) / 2
+            if longitude >= middle:
+                value = value * 2 + 1
+                west = middle
+            else:
+                value *= 2
+                east = middle
+        else:
+            middle = (south + north) / 2
+            if latitude >= middle:
+                value = value * 2 + 1
+                south = middle
+            else:
+                value *= 2
+                north = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            cell.append(BASE32[value])
+            bits = value = 0
+    return ''.join(cell)
+
+
+def bounds(cell):
+    """Returns `(south, west, north, east)` of the cell `cell`."""
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for c in cell.lower():
+        try:
+            value = _DECODE[c]
+        except KeyError:
+            raise ValueError('Invalid geohash %r' % cell)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                middle = (west + east) / 2
+                if bit:
+                    west = middle
+                else:
+                    east = middle
+            else:
+                middle = (south + north) / 2
+                if bit:
+                    south = middle
+                else:
+                    north = middle
+            even = not even
+    return south, west, north, east
+
+
+def neighbours(cell):
+    """Returns the cells of the same length around `cell`, up to 8 of them
+    (fewer next to the poles)."""
+    south, west, north, east = bounds(cell)
+    height, width = north - south, east - west
+    latitude, longitude = (south + north) / 2, (west + east) / 2
+    cells = []
+    for dy in (1, 0, -1):
+        lat = latitude + dy * height
+        if not -90 < lat < 90:
+            continue
+        for dx in (-1, 0, 1):
+            if dx or dy:
+                lng = (longitude + dx * width + 180) % 360 - 180
+                cells.append(encode(lat, lng, len(cell)))
+    return cells
+
+
+def merge_cells(cells):
+    """Returns the distinct `cells`, lower cased, without those inside
+    another of the cells, sorted."""
+    merged = []
+    for cell in sorted(set(c.lower() for c in cells if c)):
+        if not merged or not cell.startswith(merged[-1]):
+            merged.append(cell)
+    return merged
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from geopy.exc import GeopyError
+
+from address.cache import geocode_cache
+from address.models import Address
+
+
+class Command(BaseCommand):
+    help = ('Resolves the location of existing addresses without saving them and reports '
+            'throughput and latency percentiles. Meant to run with the replay geocoder backend.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--count', type=int, default=1000)
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the in-process geocode cache first.')
+
+    def handle(self, *args, **options):
+        if options['cold']:
+            geocode_cache.clear()
+
+        addresses = list(Address.objects.order_by('pk')[:options['count']])
+        timings = []
+        errors = 0
+        started = time.perf_counter()
+        for address in addresses:
+            t = time.perf_counter()
+            try:
+                address.resolve_location()
+            except GeopyError:
+                errors += 1
+            timings.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - started
+
+        if not timings:
+            self.stdout.write('No addresses to benchmark')
+            return
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(p * len(timings)))] * 1000
+
+        self.stdout.write('%d addresses in %.2fs: %.1f/s, %d errors' % (
+            len(timings), elapsed, len(timings) / elapsed, errors))
+        self.stdout.write('p50 %.2fms  p95 %.2fms  p99 %.2fms  max %.2fms' % (
+            percentile(0.50), percentile(0.95), percentile(0.99), timings[-1] * 1000))
+        self.stdout.write('cache: %(hits)d hits, %(db_hits)d db hits, %(misses)d misses' % geocode_cache.stats())
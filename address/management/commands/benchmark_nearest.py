@@ -0,0 +1,117 @@
+import heapq
+import math
+import random
+import time
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from address.density import density_key, record_changes
+from address.geohash import encode as encode_geohash
+from address.models import Address
+
+MARKER = 'benchmark_nearest'
+
+# Synthetic addresses are spread over greater São Paulo.
+BOUNDS = (-23.80, -46.85, -23.35, -46.35)
+
+
+def random_point(rnd):
+    south, west, north, east = BOUNDS
+    return rnd.uniform(south, north), rnd.uniform(west, east)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(a))
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks Address.objects.nearest() and within_radius() against a synthetic set of '
+            'addresses, created with --rows on the first run, and compares them with computing '
+            'distances in Python.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Synthetic addresses to have in the table.')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('-k', type=int, default=10)
+        parser.add_argument('--radius', type=float, default=1000, help='Metres, for within_radius.')
+        parser.add_argument('--baseline', type=int, default=3,
+                            help='Queries to run the Python way, loading every location.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cleanup', action='store_true', help='Delete the synthetic addresses and exit.')
+
+    def populate(self, rows, rnd):
+        existing = Address.objects.filter(raw=MARKER).count()
+        if existing >= rows:
+            return
+        self.stdout.write('Creating %d synthetic addresses' % (rows - existing))
+        started = time.perf_counter()
+        for start in range(existing, rows, 10000):
+            batch = []
+            for i in range(start, min(start + 10000, rows)):
+                latitude, longitude = random_point(rnd)
+                batch.append(Address(raw=MARKER, street_number='%d' % i, latitude=latitude, longitude=longitude,
+                                     location=Point(longitude, latitude, srid=4326),
+                                     geohash=encode_geohash(latitude, longitude)))
+            with transaction.atomic():
+                Address.objects.bulk_create(batch)
+                record_changes([(None, density_key(address)) for address in batch])
+        self.stdout.write('Created in %.1fs' % (time.perf_counter() - started))
+
+    def cleanup(self):
+        # A plain delete, in batches, so region memberships and anything
+        # else referencing the rows go too and the delete signals keep the
+        # address cache and cell counts right.
+        synthetic = Address.objects.filter(raw=MARKER).order_by('pk')
+        deleted = last_pk = 0
+        while True:
+            pks = list(synthetic.filter(pk__gt=last_pk).values_list('pk', flat=True)[:5000])
+            if not pks:
+                break
+            with transaction.atomic():
+                Address.objects.filter(pk__in=pks).delete()
+            last_pk = pks[-1]
+            deleted += len(pks)
+            self.stdout.write('Deleted %d synthetic addresses' % deleted)
+
+    def timed(self, label, points, query):
+        timings = []
+        found = 0
+        for point in points:
+            started = time.perf_counter()
+            found += len(query(point))
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(p * len(timings)))] * 1000
+
+        self.stdout.write('%-14s %4d queries, %6.1f rows/query  p50 %8.2fms  p95 %8.2fms  max %8.2fms' % (
+            label, len(timings), found / len(timings), percentile(0.5), percentile(0.95), timings[-1] * 1000))
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            self.cleanup()
+            return
+
+        rnd = random.Random(options['seed'])
+        self.populate(options['rows'], rnd)
+        points = [random_point(rnd) for i in range(options['queries'])]
+        k, radius = options['k'], options['radius']
+
+        self.stdout.write(Address.objects.nearest(points[0], k=k).explain())
+        self.timed('nearest', points, lambda p: list(Address.objects.nearest(p, k=k)))
+        self.timed('nearest+max', points, lambda p: list(Address.objects.nearest(p, k=k, max_distance=radius)))
+        self.timed('within_radius', points, lambda p: list(Address.objects.within_radius(p, radius)))
+
+        def in_python(point):
+            rows = Address.objects.exclude(location=None).values_list('pk', 'latitude', 'longitude')
+            return heapq.nsmallest(k, ((haversine(point[0], point[1], lat, lng), pk) for pk, lat, lng in rows
+                                       if lat is not None and lng is not None))
+
+        if options['baseline']:
+            self.timed('python', points[:options['baseline']], in_python)
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from address.normalize import normalize_address, normalize_many
+
+TEMPLATES = [
+    'Av. Dr. Arnaldo, %d - São Paulo, SP',
+    'R. Augusta %d, Consolação',
+    'RUA DA CONSOLAÇÃO, %d - CEP 01302-000',
+    'Trav. Sta. Cruz, %d / apto 12',
+    'Al. Santos, %d, Jardim Paulista, São Paulo/SP',
+    'Pça. da Sé %d',
+]
+
+# The throughput normalization has to sustain.
+TARGET = 1000000
+
+
+class Command(BaseCommand):
+    help = ('Normalizes synthetic address strings and reports how many strings a minute '
+            'normalize_address and normalize_many get through.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--count', type=int, default=200000)
+
+    def handle(self, *args, **options):
+        # Distinct values, so normalize_many can't skip repeats.
+        values = [TEMPLATES[i % len(TEMPLATES)] % i for i in range(options['count'])]
+        if not values:
+            self.stdout.write('No strings to benchmark')
+            return
+
+        self.timed('normalize_address', values, lambda: [normalize_address(v) for v in values])
+        self.timed('normalize_many', values, lambda: normalize_many(values))
+
+    def timed(self, label, values, run):
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        per_minute = len(values) / elapsed * 60
+        self.stdout.write('%s: %d strings in %.2fs, %d/min%s' % (
+            label, len(values), elapsed, per_minute,
+            '' if per_minute >= TARGET else ' (below %d/min)' % TARGET))
@@ -0,0 +1,41 @@
+import csv
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from address.cep import CepRecord, build_index
+
+
+class Command(BaseCommand):
+    help = ('Builds the binary CEP index from a CSV file with the columns '
+            'cep, logradouro, bairro, localidade, uf, latitude and longitude.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('-o', '--output', default=getattr(settings, 'ADDRESS_CEP_INDEX', None),
+                            help='Index file to write. Defaults to ADDRESS_CEP_INDEX.')
+        parser.add_argument('-d', '--delimiter', default=',')
+        parser.add_argument('--encoding', default='utf-8')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        if not output:
+            raise CommandError('No output given and ADDRESS_CEP_INDEX is not set.')
+
+        def rows(reader):
+            for row in reader:
+                yield CepRecord(
+                    row.get('cep'),
+                    row.get('logradouro'),
+                    row.get('bairro'),
+                    row.get('localidade'),
+                    row.get('uf'),
+                    row.get('latitude'),
+                    row.get('longitude'),
+                )
+
+        with open(options['csv_file'], newline='', encoding=options['encoding']) as f:
+            reader = csv.DictReader(f, delimiter=options['delimiter'])
+            count = build_index(rows(reader), output)
+
+        self.stdout.write('Wrote %d CEPs to %s' % (count, output))
@@ -0,0 +1,154 @@
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from geopy.exc import GeopyError
+
+from address.cache import address_cache
+from address.density import density_key, record_changes
+from address.geohash import encode as encode_geohash
+from address.models import Address
+from address.regions import schedule_memberships
+
+FIELDS = ['latitude', 'longitude', 'location', 'geohash', 'geocode_pending']
+
+
+class Command(BaseCommand):
+    help = ('Geocodes addresses without a location (or with a pending geocode) in bulk. '
+            'Progress is checkpointed so an interrupted run resumes where it stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Geocoding threads. The shared geocoder client still enforces '
+                                 'its own rate and concurrency limits.')
+        parser.add_argument('--checkpoint', default='geocode_addresses.checkpoint',
+                            help='File recording the last processed primary key.')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint and start from the first address.')
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return int(f.read().strip() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def write_checkpoint(self, path, pk):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('%d\n' % pk)
+        os.replace(tmp, path)
+
+    def geocode(self, address):
+        # Returns `(address, coords, error)`; `error` is set when the lookup
+        # failed and is worth retrying.
+        try:
+            return address, address.geocode(), None
+        except GeopyError as e:
+            self.stderr.write('Address %s: %s' % (address.pk, e))
+            return address, None, e
+        except Exception as e:
+            return address, None, e
+
+    def work(self, tasks, results):
+        # One per pool thread, so each thread keeps a single database
+        # connection for the whole run and closes it once at the end.
+        try:
+            for address in iter(tasks.get, None):
+                results.put(self.geocode(address))
+        finally:
+            connection.close()
+
+    def process(self, chunk, tasks, results):
+        """Geocodes and stores `chunk`. Returns `(geocoded, failed)`, the
+        number of addresses geocoded and the pks of those that failed."""
+        for address in chunk:
+            tasks.put(address)
+        updated, failed = [], []
+        for address, coords, error in sorted((results.get() for address in chunk), key=lambda r: r[0].pk):
+            if error is not None and not isinstance(error, GeopyError):
+                raise error
+            if error is not None:
+                failed.append(address.pk)
+            elif coords:
+                address.latitude, address.longitude = coords
+                address.location = Point(address.longitude, address.latitude)
+                address.geohash = encode_geohash(address.latitude, address.longitude)
+                address.geocode_pending = False
+                updated.append(address)
+        with transaction.atomic():
+            Address.objects.bulk_update(updated, FIELDS)
+            record_changes([(address._density_snapshot, density_key(address)) for address in updated])
+        address_cache.invalidate(*[address.pk for address in updated])
+        schedule_memberships(address_ids=[address.pk for address in updated])
+        return len(updated), failed
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        checkpoint = options['checkpoint']
+        last_pk = 0 if options['restart'] else self.read_checkpoint(checkpoint)
+        if last_pk:
+            self.stdout.write('Resuming after address %d' % last_pk)
+
+        candidates = Address.objects.filter(Q(location__isnull=True) | Q(geocode_pending=True)).order_by('pk').only(
+            'pk', 'street_number', 'route', 'city', 'state', 'zip_code', 'locality', 'geohash', 'owner')
+        total = candidates.filter(pk__gt=last_pk).count()
+        done = found = 0
+        failed = []
+        started = time.monotonic()
+
+        workers = options['workers']
+        tasks, results = queue.Queue(), queue.Queue()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i in range(workers):
+                pool.submit(self.work, tasks, results)
+            try:
+                while True:
+                    chunk = list(candidates.filter(pk__gt=last_pk)[:chunk_size])
+                    if not chunk:
+                        break
+                    geocoded, chunk_failed = self.process(chunk, tasks, results)
+                    failed.extend(chunk_failed)
+
+                    # A resumed run starts again at the first failure; the
+                    # addresses geocoded since then are no longer candidates.
+                    last_pk = chunk[-1].pk
+                    self.write_checkpoint(checkpoint, failed[0] - 1 if failed else last_pk)
+
+                    done += len(chunk)
+                    found += geocoded
+                    elapsed = time.monotonic() - started
+                    rate = done / elapsed if elapsed else 0
+                    eta = (total - done) / rate if rate else 0
+                    self.stdout.write('%d/%d addresses, %d geocoded, %.1f/s, ETA %ds' % (
+                        done, total, found, rate, eta))
+
+                # Lookups that failed, usually for a transient reason, are
+                # tried once more.
+                if failed:
+                    self.stdout.write('Retrying %d failed addresses' % len(failed))
+                    retry, failed = failed, []
+                    for start in range(0, len(retry), chunk_size):
+                        chunk = list(candidates.filter(pk__in=retry[start:start + chunk_size]))
+                        geocoded, chunk_failed = self.process(chunk, tasks, results)
+                        found += geocoded
+                        failed.extend(chunk_failed)
+            finally:
+                for i in range(workers):
+                    tasks.put(None)
+
+        if failed:
+            self.write_checkpoint(checkpoint, min(failed) - 1)
+            self.stdout.write('Geocoded %d of %d addresses, %d failed; run again to retry them' % (
+                found, done, len(failed)))
+        else:
+            if os.path.exists(checkpoint):
+                os.unlink(checkpoint)
+            self.stdout.write('Geocoded %d of %d addresses' % (found, done))
@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DataError, connections, transaction
+
+from address.models import PARSE_RAW, raw_key, to_python_many
+from address.parser import locality_index, parse_address
+
+FIELDS = ('raw', 'street_number', 'route', 'locality', 'sublocality', 'city', 'postal_code',
+          'state', 'state_code', 'country', 'country_code', 'formatted', 'latitude', 'longitude')
+
+
+def read_rows(path, fmt, delimiter, encoding):
+    """Yields the rows of a CSV file as dicts, or the lines of a JSON lines
+    file as strings, decoded by `clean_row`."""
+    with io.open(path, encoding=encoding, newline='') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f, delimiter=delimiter):
+                yield row
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def init_worker(names, states):
+    # The parent loaded the locality index; parse against that copy.
+    locality_index.use(names, states)
+
+
+def clean_row(row):
+    """Returns `(value, None)` with the dictionary to pass to `to_python`, or
+    `(None, reason)` for rows that can't be imported. Runs in worker
+    processes, so it must not touch the database.
+
+    The value carries its normalized `raw_key` and, if its components are
+    inconsistent, the `parsed` raw value, so `to_python_many` doesn't redo
+    that work in the main process."""
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError as e:
+            return None, 'invalid JSON: %s' % e
+    if not isinstance(row, dict):
+        return None, 'not a JSON object'
+    value = {}
+    for field in FIELDS:
+        v = row.get(field)
+        value[field] = ' '.join(('%s' % v).split()) if v is not None else ''
+    for field in ('latitude', 'longitude'):
+        if value[field]:
+            try:
+                value[field] = float(value[field].replace(',', '.'))
+            except ValueError:
+                return None, 'invalid %s' % field
+        else:
+            value[field] = None
+    if not value['raw']:
+        value['raw'] = ', '.join(x for x in [
+            ' '.join(x for x in [value['street_number'], value['route']] if x),
+            value['locality'] or value['city'], value['state'], value['postal_code'],
+        ] if x)
+    if not value['raw']:
+        return None, 'empty address'
+    places = (value['country'], value['state'], value['locality'] or value['sublocality'] or value['city'])
+    if PARSE_RAW and any(places) and not all(places):
+        # `to_python_many` keeps only the raw value of these; parse it here.
+        value['parsed'] = parse_address(value['raw'])
+    value['raw_key'] = raw_key(value['raw'])
+    return value, None
+
+
+class Command(BaseCommand):
+    help = ('Imports addresses from a CSV or JSON lines file in chunks. Rows are cleaned in '
+            'worker processes and each chunk is written in one transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes cleaning rows. Defaults to the number of CPUs.')
+        parser.add_argument('-d', '--delimiter', default=',')
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument('--rejected', help='Where to write rejected rows. '
+                                               'Defaults to PATH.rejected.jsonl.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Import everything in transactions that are rolled back.')
+
+    def import_chunk(self, values, dry_run):
+        """Imports `values`, returning `(imported, [(value, reason)])`."""
+        try:
+            with transaction.atomic():
+                to_python_many(values)
+                if dry_run:
+                    transaction.set_rollback(True)
+            return len(values), []
+        except (ValueError, DataError):
+            pass
+
+        # Something in the chunk is invalid; find it row by row.
+        imported, rejected = 0, []
+        for value in values:
+            try:
+                with transaction.atomic():
+                    to_python_many([value])
+                    if dry_run:
+                        transaction.set_rollback(True)
+                imported += 1
+            except (ValueError, DataError) as e:
+                rejected.append((value, '%s' % e))
+        return imported, rejected
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        rejected_path = options['rejected'] or path + '.rejected.jsonl'
+        dry_run = options['dry_run']
+
+        if not os.path.exists(path):
+            raise CommandError('No such file: %s' % path)
+        rows = read_rows(path, fmt, options['delimiter'], options['encoding'])
+
+        # Don't share open database connections with the forked workers.
+        index = locality_index.load() if PARSE_RAW else (None, None)
+        connections.close_all()
+
+        total = imported = rejected = 0
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker, initargs=index) as pool, \
+                io.open(rejected_path, 'w', encoding='utf-8') as rejected_file:
+
+            def reject(row, reason):
+                rejected_file.write(json.dumps(dict(row=row, reason=reason), ensure_ascii=False) + '\n')
+
+            for chunk in chunked(rows, options['chunk_size']):
+                values = []
+                for row, (value, reason) in zip(chunk, pool.map(clean_row, chunk, chunksize=200)):
+                    if value is None:
+                        reject(row, reason)
+                    else:
+                        values.append(value)
+
+                done, failed = self.import_chunk(values, dry_run) if values else (0, [])
+                for value, reason in failed:
+                    reject(dict((field, value[field]) for field in FIELDS), reason)
+
+                total += len(chunk)
+                imported += done
+                rejected += len(chunk) - done
+                elapsed = time.monotonic() - started
+                self.stdout.write('%d rows, %d imported, %d rejected, %.0f rows/s' % (
+                    total, imported, rejected, total / elapsed if elapsed else 0))
+
+        self.stdout.write('%s %d of %d rows%s. Rejected rows are in %s' % (
+            'Checked' if dry_run else 'Imported', imported, total,
+            ' (dry run, nothing saved)' if dry_run else '', rejected_path))
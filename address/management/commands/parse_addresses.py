@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from address.cache import address_cache
+from address.models import Address, set_labels
+from address.parser import MIN_CONFIDENCE, parse_many
+
+FIELDS = ['route', 'street_number', 'extra', 'neigh', 'city', 'state', 'zip_code', 'locality',
+          'canonical_key', 'formatted', 'display']
+
+
+class Command(BaseCommand):
+    help = ('Fills the components of addresses stored only as a raw string by parsing it offline. '
+            'Addresses that can\'t be parsed with enough confidence are left alone.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be filled without saving anything.')
+
+    def handle(self, *args, **options):
+        min_confidence = options['min_confidence']
+        candidates = Address.objects.exclude(raw=None).exclude(raw='').filter(
+            route='', street_number='', city='', locality=None).order_by('pk')
+
+        last_pk = done = filled = 0
+        while True:
+            chunk = list(candidates.filter(pk__gt=last_pk).only(
+                'pk', 'raw', 'locality', 'latitude', 'longitude', 'formatted')[:options['chunk_size']])
+            if not chunk:
+                break
+
+            updated = []
+            for address, parsed in zip(chunk, parse_many([a.raw for a in chunk])):
+                if parsed.confidence < min_confidence:
+                    continue
+                for field, value in parsed.as_fields().items():
+                    setattr(address, field, value)
+                address.canonical_key = address.make_canonical_key()
+                updated.append(address)
+            set_labels(updated, rebuild=True)
+            if not options['dry_run']:
+                with transaction.atomic():
+                    Address.objects.bulk_update(updated, FIELDS)
+                    address_cache.invalidate(*[address.pk for address in updated])
+
+            last_pk = chunk[-1].pk
+            done += len(chunk)
+            filled += len(updated)
+            self.stdout.write('%d addresses, %d parsed' % (done, filled))
+
+        self.stdout.write('%s %d of %d raw addresses' % (
+            'Would fill' if options['dry_run'] else 'Filled', filled, done))
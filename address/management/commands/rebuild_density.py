@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from address.density import LENGTHS, rebuild
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the address counts per geohash cell from scratch. Address writes keep them '
+            'up to date; run this after writes that bypass the ORM or after changing '
+            'ADDRESS_DENSITY_LENGTHS.')
+
+    def handle(self, *args, **options):
+        cells = rebuild()
+        self.stdout.write('Counted addresses in %d cells of lengths %s' % (
+            cells, ', '.join(str(length) for length in LENGTHS)))
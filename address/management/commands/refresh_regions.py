@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from address.regions import refresh_memberships
+
+
+class Command(BaseCommand):
+    help = ('Recomputes which addresses are inside which regions. Saving a region or an address '
+            'already does this for it; use this after loading regions or addresses in bulk.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--region', type=int, action='append', dest='regions',
+                            help='Only recompute this region. May be given several times.')
+
+    def handle(self, *args, **options):
+        written = refresh_memberships(region_ids=options['regions'])
+        self.stdout.write('Wrote %d address region memberships' % written)
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0009_cachedgeocode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='geocode_pending',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+# The column is filled by 0013_rekey_addresses.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0011_address_canonical_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='raw_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,141 @@
+import hashlib
+import re
+import unicodedata
+
+from django.db import migrations
+
+
+# Recomputes `canonical_key` and `raw_key` after the switch to
+# `address.normalize`, so "R. Augusta" and "Rua Augusta" share their keys,
+# and keys addresses without a locality by their city or coordinates.
+# Frozen copies of `address.normalize.normalize_address`, `address.models.canonical_key`
+# and `raw_key` as they were when this migration was written.
+STREET_TYPES = {
+    'r': 'rua',
+    'av': 'avenida',
+    'ave': 'avenida',
+    'al': 'alameda',
+    'trav': 'travessa',
+    'tv': 'travessa',
+    'pc': 'praca',
+    'pca': 'praca',
+    'rod': 'rodovia',
+    'estr': 'estrada',
+    'est': 'estrada',
+    'lg': 'largo',
+    'lgo': 'largo',
+    'lad': 'ladeira',
+    'pq': 'parque',
+    'vl': 'vila',
+    'jd': 'jardim',
+    'bc': 'beco',
+    'cond': 'condominio',
+    'conj': 'conjunto',
+    'qd': 'quadra',
+}
+
+WORDS = {
+    'dr': 'doutor',
+    'dra': 'doutora',
+    'prof': 'professor',
+    'profa': 'professora',
+    'eng': 'engenheiro',
+    'sen': 'senador',
+    'dep': 'deputado',
+    'gov': 'governador',
+    'pres': 'presidente',
+    'mal': 'marechal',
+    'gal': 'general',
+    'gen': 'general',
+    'cel': 'coronel',
+    'cap': 'capitao',
+    'ten': 'tenente',
+    'alm': 'almirante',
+    'cmte': 'comandante',
+    'fr': 'frei',
+    'sto': 'santo',
+    'sta': 'santa',
+    'nro': 'n',
+    'num': 'n',
+    'apto': 'apartamento',
+    'ap': 'apartamento',
+    'bl': 'bloco',
+}
+
+_FOLD = {}
+for _code in range(0xC0, 0x250):
+    _char = chr(_code)
+    _base = ''.join(c for c in unicodedata.normalize('NFKD', _char) if not unicodedata.combining(c))
+    if _base != _char and all(ord(c) < 128 for c in _base):
+        _FOLD[_code] = _base
+_FOLD.update({ord('º'): 'o', ord('ª'): 'a', ord('ß'): 'ss', ord('æ'): 'ae', ord('Æ'): 'AE',
+              ord('ø'): 'o', ord('Ø'): 'O', ord('œ'): 'oe', ord('Œ'): 'OE'})
+_ACCENTS = str.maketrans(_FOLD)
+_PUNCTUATION = str.maketrans({c: ' ' for c in '.,;:/\\()[]{}"\'`´!?#*_|'})
+
+_street_type_re = re.compile(r'^(%s)(?= \S)' % '|'.join(sorted(STREET_TYPES, key=len, reverse=True)))
+_words_re = re.compile(r'\b(%s)\b' % '|'.join(sorted(WORDS, key=len, reverse=True)))
+
+
+def normalize_address(value):
+    if not value:
+        return ''
+    value = value.translate(_ACCENTS).lower()
+    parts = []
+    for part in value.split(','):
+        part = ' '.join(t for t in part.translate(_PUNCTUATION).split() if t != '-')
+        if part:
+            part = _street_type_re.sub(lambda match: STREET_TYPES[match.group(1)], part, 1)
+            parts.append(_words_re.sub(lambda match: WORDS[match.group(1)], part))
+    return ' '.join(parts)
+
+
+def _hash(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def canonical_key(street_number, route, locality_id, city, state, zip_code, latitude, longitude):
+    if not (street_number or route):
+        return None
+    if locality_id:
+        place = ['%s' % locality_id]
+    else:
+        place = [normalize_address(city), normalize_address(state), ''.join(c for c in zip_code or '' if c.isdigit())]
+        if not any(place):
+            if latitude is None or longitude is None:
+                return None
+            place = ['%.3f' % float(latitude), '%.3f' % float(longitude)]
+    return _hash('|'.join([normalize_address(street_number), normalize_address(route)] + place))
+
+
+def raw_key(raw):
+    raw = normalize_address(raw)
+    return _hash(raw) if raw else None
+
+
+def rekey(apps, schema_editor):
+    Address = apps.get_model('address', 'Address')
+    batch = []
+    rows = Address.objects.order_by('pk').only('pk', 'raw', 'street_number', 'route', 'locality', 'city', 'state',
+                                               'zip_code', 'latitude', 'longitude')
+    for address in rows.iterator(chunk_size=2000):
+        address.canonical_key = canonical_key(address.street_number, address.route, address.locality_id,
+                                              address.city, address.state, address.zip_code,
+                                              address.latitude, address.longitude)
+        address.raw_key = raw_key(address.raw)
+        batch.append(address)
+        if len(batch) >= 2000:
+            Address.objects.bulk_update(batch, ['canonical_key', 'raw_key'])
+            batch = []
+    Address.objects.bulk_update(batch, ['canonical_key', 'raw_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0012_address_raw_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey, migrations.RunPython.noop),
+    ]
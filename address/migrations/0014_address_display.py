@@ -0,0 +1,59 @@
+from django.db import migrations, models
+
+
+# Frozen copy of `address.models._label` as it was when this migration was
+# written.
+def label(address, locality=None):
+    street = ' '.join(x for x in [address.street_number, address.route] if x)
+    if locality:
+        name, postal_code, state, country = locality
+        place = ', '.join(x for x in [name, state] if x)
+        if postal_code:
+            place += ' %s' % postal_code
+        value = ', '.join(x for x in [street, address.neigh, place.strip(), country] if x)
+    else:
+        value = ', '.join(x for x in [street, address.neigh, address.city, address.state] if x)
+        if address.zip_code:
+            zip_code = address.zip_code
+            if len(zip_code) == 8 and zip_code.isdigit():
+                zip_code = '%s-%s' % (zip_code[:5], zip_code[5:])
+            value += ' - CEP: %s' % zip_code
+    return value.strip(' ,-') or (address.raw or '')
+
+
+def backfill(apps, schema_editor):
+    Address = apps.get_model('address', 'Address')
+    Locality = apps.get_model('address', 'Locality')
+    labels = {}
+    rows = Locality.objects.values_list(
+        'pk', 'name', 'postal_code', 'state__code', 'state__name', 'state__country__name')
+    for pk, name, postal_code, state_code, state_name, country in rows.iterator():
+        labels[pk] = (name, postal_code, state_name or state_code or '', country or '')
+
+    batch = []
+    for address in Address.objects.order_by('pk').iterator(chunk_size=2000):
+        # Empty values, and the "  ,  - CEP: " built for raw only addresses.
+        if not address.formatted.replace('CEP', '').strip(' ,-:'):
+            address.formatted = label(address)[:200]
+        address.display = label(address, labels.get(address.locality_id))[:255]
+        batch.append(address)
+        if len(batch) >= 2000:
+            Address.objects.bulk_update(batch, ['formatted', 'display'])
+            batch = []
+    Address.objects.bulk_update(batch, ['formatted', 'display'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0013_rekey_addresses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='display',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
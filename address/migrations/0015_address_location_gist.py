@@ -0,0 +1,49 @@
+from django.db import migrations
+
+INDEX_NAME = 'address_address_location_gist'
+
+# GeoDjango creates a GiST index on `location` along with the column; this
+# makes sure one exists, as the KNN queries of `AddressQuerySet.nearest`
+# depend on it, and refreshes the planner statistics.
+HAS_GIST_INDEX = '''
+    SELECT 1
+      FROM pg_index i
+      JOIN pg_class c ON c.oid = i.indexrelid
+      JOIN pg_am am ON am.oid = c.relam
+      JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+     WHERE i.indrelid = %s::regclass AND a.attname = 'location' AND am.amname = 'gist'
+'''
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('address', 'Address')._meta.db_table
+    quote = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(HAS_GIST_INDEX, [table])
+        if cursor.fetchone() is None:
+            cursor.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s USING GIST (location)' % (
+                quote(INDEX_NAME), quote(table)))
+        cursor.execute('ANALYZE %s' % quote(table))
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS %s' % schema_editor.quote_name(INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('address', '0014_address_display'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,42 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0015_address_location_gist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Region',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kind', models.CharField(blank=True, db_index=True, max_length=50)),
+                ('area', django.contrib.gis.db.models.fields.MultiPolygonField(geography=True, srid=4326)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ('kind', 'name'),
+            },
+        ),
+        migrations.CreateModel(
+            name='AddressRegion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='region_memberships', to='address.Address')),
+                ('region', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='address.Region')),
+            ],
+            options={
+                'unique_together': {('region', 'address')},
+            },
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='addresses',
+            field=models.ManyToManyField(related_name='regions', through='address.AddressRegion', to='address.Address'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations, models
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+# Frozen copy of `address.geohash.encode` as it was when this migration was
+# written.
+def encode(latitude, longitude, length=12):
+    if latitude is None or longitude is None:
+        return ''
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    cell = []
+    bits = value = 0
+    even = True
+    while len(cell) < length:
+        if even:
+            middle = (west + east) / 2
+            if longitude >= middle:
+                value = value * 2 + 1
+                west = middle
+            else:
+                value *= 2
+                east = middle
+        else:
+            middle = (south + north) / 2
+            if latitude >= middle:
+                value = value * 2 + 1
+                south = middle
+            else:
+                value *= 2
+                north = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            cell.append(BASE32[value])
+            bits = value = 0
+    return ''.join(cell)
+
+
+def backfill(apps, schema_editor):
+    Address = apps.get_model('address', 'Address')
+    rows = Address.objects.exclude(latitude=None).exclude(longitude=None).order_by('pk').only(
+        'pk', 'latitude', 'longitude')
+    batch = []
+    for address in rows.iterator(chunk_size=2000):
+        address.geohash = encode(address.latitude, address.longitude)
+        batch.append(address)
+        if len(batch) >= 2000:
+            Address.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    Address.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0016_region_addressregion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Substr
+
+
+# Frozen copy of `address.density.rebuild` as it was when this migration was
+# written.
+def backfill(apps, schema_editor):
+    Address = apps.get_model('address', 'Address')
+    CellDensity = apps.get_model('address', 'CellDensity')
+    rows = []
+    addresses = Address.objects.exclude(geohash='').order_by()
+    for length in getattr(settings, 'ADDRESS_DENSITY_LENGTHS', (4, 5, 6, 7)):
+        counts = addresses.annotate(cell=Substr('geohash', 1, length)).values('cell').annotate(
+            count=Count('pk'), owners=Count('owner'))
+        rows.extend(CellDensity(cell=row['cell'], length=length, addresses=row['count'], owned=row['owners'])
+                    for row in counts)
+    CellDensity.objects.bulk_create(rows, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0017_address_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CellDensity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.CharField(max_length=12, unique=True)),
+                ('length', models.PositiveSmallIntegerField(db_index=True)),
+                ('addresses', models.IntegerField(default=0)),
+                ('owned', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('cell',),
+                'verbose_name_plural': 'cell densities',
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
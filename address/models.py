@@ -1,11 +1,17 @@
+import hashlib
 import logging
+import operator
 import sys
+import weakref
+from functools import reduce
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Prefetch, Q, prefetch_related_objects
+from django.db.models.signals import class_prepared
 from django.db.models.fields.related import ForeignObject
-
-from compramim.users.models import Buyer
+from django.utils import timezone
 
 try:
     from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
@@ -15,12 +21,21 @@ except ImportError:
 from django.contrib.gis.db import models as geomodels
 from django.contrib.gis.geos import GEOSGeometry, GEOSException
 from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
 
 from django.utils.translation import ugettext_lazy as _
 
 from compramim.compra.models import AuditMixin
 
-from geopy.geocoders import Nominatim
+from geopy.exc import GeopyError
+
+from .cache import address_cache, normalize_query
+from .density import density_key, record_changes
+from .geohash import LENGTH as GEOHASH_LENGTH, encode as encode_geohash, merge_cells
+from .normalize import format_cep
+from .owners import link_owners
+from .parser import MIN_CONFIDENCE, locality_index, parse_address, parse_many
+from .regions import schedule_memberships
 
 import logging
 logger = logging.getLogger(__name__)
@@ -30,14 +45,176 @@ if sys.version > '3':
     basestring = (str, bytes)
     unicode = str
 
-__all__ = ['Country', 'State', 'Locality', 'Address', 'AddressField']
+GEOCODE_ASYNC = getattr(settings, 'ADDRESS_GEOCODE_ASYNC', False)
+PARSE_RAW = getattr(settings, 'ADDRESS_PARSE_RAW', True)
+SELECT_HIERARCHY = getattr(settings, 'ADDRESS_SELECT_HIERARCHY', False)
+FIELD_PREFETCH = getattr(settings, 'ADDRESS_FIELD_PREFETCH', True)
+
+__all__ = ['Country', 'State', 'Locality', 'Address', 'AddressField', 'CachedGeocode', 'Region', 'AddressRegion',
+           'CellDensity']
 
 
 class InconsistentDictError(Exception):
     pass
 
 
-def _to_python(value):
+def _clean_code(model, code, name):
+    # Codes too long for the column are dropped when they merely repeat the
+    # name, anything else is an error.
+    if len(code) > model._meta.get_field('code').max_length:
+        if code != name:
+            raise ValueError('Invalid %s code (too long): %s' % (model._meta.model_name, code))
+        code = ''
+    return code
+
+
+def _create(model, lookup, **values):
+    """Creates a row and returns its pk. If a concurrent request created it
+    first, the existing row's pk is returned instead."""
+    try:
+        with transaction.atomic():
+            return model.objects.create(**dict(lookup, **values)).pk
+    except IntegrityError:
+        return model.objects.get(**lookup).pk
+
+
+def _get_or_create_hierarchy(country, country_code, state, state_code, locality, postal_code):
+    # Handle the country.
+    try:
+        country_id = Country.objects.get(name=country).pk
+    except Country.DoesNotExist:
+        country_id = None
+        if country:
+            country_id = _create(Country, dict(name=country), code=_clean_code(Country, country_code, country))
+
+    # Handle the state.
+    try:
+        state_id = State.objects.get(name=state, country_id=country_id).pk
+    except State.DoesNotExist:
+        state_id = None
+        if state:
+            state_id = _create(State, dict(name=state, country_id=country_id), code=_clean_code(State, state_code, state))
+
+    # Handle the locality.
+    try:
+        locality_id = Locality.objects.get(name=locality, postal_code=postal_code, state_id=state_id).pk
+    except Locality.DoesNotExist:
+        locality_id = None
+        if locality:
+            locality_id = _create(Locality, dict(name=locality, postal_code=postal_code, state_id=state_id))
+
+    return country_id, state_id, locality_id
+
+
+_UPSERT_HIERARCHY_SQL = """
+WITH c_new AS (
+    INSERT INTO {country} ({c_name}, {c_code}) VALUES (%s, %s)
+    ON CONFLICT ({c_name}) DO NOTHING RETURNING {c_pk}
+), c AS (
+    SELECT {c_pk} AS id FROM c_new
+    UNION ALL SELECT {c_pk} FROM {country} WHERE {c_name} = %s
+    LIMIT 1
+), s_new AS (
+    INSERT INTO {state} ({s_name}, {s_code}, {s_country}) SELECT %s, %s, id FROM c
+    ON CONFLICT ({s_name}, {s_country}) DO NOTHING RETURNING {s_pk}
+), s AS (
+    SELECT {s_pk} AS id FROM s_new
+    UNION ALL SELECT {state}.{s_pk} FROM {state}, c WHERE {state}.{s_name} = %s AND {state}.{s_country} = c.id
+    LIMIT 1
+), l_new AS (
+    INSERT INTO {locality} ({l_name}, {l_postal_code}, {l_state}) SELECT %s, %s, id FROM s
+    ON CONFLICT ({l_name}, {l_postal_code}, {l_state}) DO NOTHING RETURNING {l_pk}
+), l AS (
+    SELECT {l_pk} AS id FROM l_new
+    UNION ALL SELECT {locality}.{l_pk} FROM {locality}, s
+    WHERE {locality}.{l_name} = %s AND {locality}.{l_postal_code} = %s AND {locality}.{l_state} = s.id
+    LIMIT 1
+)
+SELECT (SELECT id FROM c), (SELECT id FROM s), (SELECT id FROM l)
+"""
+
+
+def _upsert_hierarchy_sql(connection):
+    qn = connection.ops.quote_name
+
+    def columns(prefix, model, *fields):
+        names = {prefix: qn(model._meta.db_table), prefix[0] + '_pk': qn(model._meta.pk.column)}
+        for field in fields:
+            names['%s_%s' % (prefix[0], field)] = qn(model._meta.get_field(field).column)
+        return names
+
+    names = columns('country', Country, 'name', 'code')
+    names.update(columns('state', State, 'name', 'code', 'country'))
+    names.update(columns('locality', Locality, 'name', 'postal_code', 'state'))
+    return _UPSERT_HIERARCHY_SQL.format(**names)
+
+
+def _upsert_hierarchy(connection, country, country_code, state, state_code, locality, postal_code):
+    """Finds or creates the whole hierarchy in one `INSERT ... ON CONFLICT DO
+    NOTHING RETURNING` statement (PostgreSQL only).
+
+    A row committed by a concurrent transaction after the statement started
+    is neither inserted nor visible to it, so the statement is run once more
+    before giving up and returning `None`.
+    """
+    params = [country, country_code, country,
+              state, state_code, state,
+              locality, postal_code, locality, postal_code]
+    with connection.cursor() as cursor:
+        for attempt in range(2):
+            cursor.execute(_upsert_hierarchy_sql(connection), params)
+            ids = cursor.fetchone()
+            if None not in ids:
+                return tuple(ids)
+    return None
+
+
+def _resolve_hierarchy(country, country_code, state, state_code, locality, postal_code):
+    """Returns the pks of the country, state and locality, creating them as
+    needed. The names must be either all set or all empty.
+
+    Cached pks are used when available. Otherwise a single upsert statement
+    is used on PostgreSQL, and get-or-create queries elsewhere, both safe
+    against concurrent requests creating the same place.
+    """
+    from .cache import hierarchy_cache
+
+    country_id = hierarchy_cache.get(Country, country)
+    state_id = hierarchy_cache.get(State, state, country_id) if country_id else None
+    locality_id = hierarchy_cache.get(Locality, locality, postal_code, state_id) if state_id else None
+    if locality_id:
+        return country_id, state_id, locality_id
+
+    connection = connections[router.db_for_write(Locality)]
+    ids = None
+    with transaction.atomic(using=connection.alias):
+        if country and connection.vendor == 'postgresql':
+            try:
+                codes = _clean_code(Country, country_code, country), _clean_code(State, state_code, state)
+            except ValueError:
+                # Only an error if the place has to be created.
+                codes = None
+            if codes:
+                ids = _upsert_hierarchy(connection, country, codes[0], state, codes[1], locality, postal_code)
+        if ids is None:
+            ids = _get_or_create_hierarchy(country, country_code, state, state_code, locality, postal_code)
+
+    country_id, state_id, locality_id = ids
+    # The upsert creates rows without `post_save`.
+    locality_index.add_many([(locality_id, locality, state_id)])
+    hierarchy_cache.set(Country, country_id, country)
+    hierarchy_cache.set(State, state_id, state, country_id)
+    hierarchy_cache.set(Locality, locality_id, locality, postal_code, state_id)
+    return ids
+
+
+def _parse(value):
+    """Extracts the components of an address dictionary.
+
+    Returns `None` when there is no raw value and raises
+    `InconsistentDictError` when country, state and locality are not either
+    all given or all missing.
+    """
     raw = value.get('raw', '')
     country = value.get('country', '')
     country_code = value.get('country_code', '')
@@ -85,71 +262,99 @@ def _to_python(value):
         logger.debug(country, state, locality)
         raise InconsistentDictError
 
-    # Handle the country.
-    try:
-        country_obj = Country.objects.get(name=country)
-    except Country.DoesNotExist:
-        if country:
-            if len(country_code) > Country._meta.get_field('code').max_length:
-                if country_code != country:
-                    raise ValueError('Invalid country code (too long): %s' % country_code)
-                country_code = ''
-            country_obj = Country.objects.create(name=country, code=country_code)
-        else:
-            country_obj = None
+    return dict(
+        raw=raw, country=country, country_code=country_code, state=state, state_code=state_code,
+        locality=locality, postal_code=postal_code, street_number=street_number, route=route,
+        formatted=formatted, latitude=latitude, longitude=longitude, location=location,
+    )
+
+
+def canonical_key(street_number, route, locality_id, city='', state='', zip_code='', latitude=None,
+                  longitude=None):
+    """Returns the `Address.canonical_key` for the given components: a hash
+    of the normalized street number and route and the place they are in.
+    The place is the locality; without one, the normalized city, state and
+    CEP, or failing those the coordinates rounded to about 100m, so the same
+    street in two cities gets two keys. Addresses without a street, or
+    without any place, have no key.
+    """
+    if not (street_number or route):
+        return None
+    if locality_id:
+        place = ['%s' % locality_id]
+    else:
+        place = [normalize_query(city), normalize_query(state), ''.join(c for c in zip_code or '' if c.isdigit())]
+        if not any(place):
+            if latitude is None or longitude is None:
+                return None
+            place = ['%.3f' % float(latitude), '%.3f' % float(longitude)]
+    key = '|'.join([normalize_query(street_number), normalize_query(route)] + place)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def raw_key(raw):
+    """Returns the `Address.raw_key` for a raw address string: a hash of the
+    string as normalized by `address.normalize.normalize_address`."""
+    raw = normalize_query(raw)
+    if not raw:
+        return None
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
 
-    # Handle the state.
-    try:
-        state_obj = State.objects.get(name=state, country=country_obj)
-    except State.DoesNotExist:
-        if state:
-            if len(state_code) > State._meta.get_field('code').max_length:
-                if state_code != state:
-                    raise ValueError('Invalid state code (too long): %s' % state_code)
-                state_code = ''
-            state_obj = State.objects.create(name=state, code=state_code, country=country_obj)
-        else:
-            state_obj = None
 
-    # Handle the locality.
-    try:
-        locality_obj = Locality.objects.get(name=locality, postal_code=postal_code, state=state_obj)
-    except Locality.DoesNotExist:
-        if locality:
-            locality_obj = Locality.objects.create(name=locality, postal_code=postal_code, state=state_obj)
-        else:
-            locality_obj = None
+def _parsed_fields(parsed):
+    """Returns the `Address` fields to fill from a `ParsedAddress`, or none
+    if the parse is not confident enough."""
+    if parsed is None or parsed.confidence < MIN_CONFIDENCE:
+        return {}
+    return parsed.as_fields()
+
+
+def _raw_address(raw):
+    """Returns the address stored for the raw string `raw`, creating it
+    only if no address has the same normalized raw value. New addresses
+    get the components `address.parser` finds in `raw`."""
+    key = raw_key(raw)
+    address_obj = Address.objects.filter(raw_key=key).order_by('pk').first() if key else None
+    if address_obj is None:
+        address_obj = Address(raw=raw, **_parsed_fields(parse_address(raw) if PARSE_RAW else None))
+        address_obj.save()
+    return address_obj
+
+
+def _to_python(value):
+    parts = _parse(value)
+    if parts is None:
+        return None
+    raw, locality, street_number, route, location = (
+        parts['raw'], parts['locality'], parts['street_number'], parts['route'], parts['location'])
+
+    country_id, state_id, locality_id = _resolve_hierarchy(
+        parts['country'], parts['country_code'], parts['state'], parts['state_code'],
+        locality, parts['postal_code'])
 
     # Handle the address.
-    try:
-        if not (street_number or route or locality):
-            address_obj = Address.objects.get(raw=raw)
-        else:
-            address_obj = Address.objects.get(
-                street_number=street_number,
-                route=route,
-                locality=locality_obj,
-                location__intersects=location
-            )
-    except Address.DoesNotExist:
+    key = canonical_key(street_number, route, locality_id, latitude=parts['latitude'],
+                        longitude=parts['longitude'])
+    if key is None:
+        key = raw_key(raw)
+        address_obj = Address.objects.filter(raw_key=key).order_by('pk').first() if key else None
+    else:
+        address_obj = Address.objects.filter(canonical_key=key).order_by('pk').first()
+    if address_obj is None:
         logger.debug('Creating address, with location: ')
         logger.debug(location)
         address_obj = Address(
             street_number=street_number,
             route=route,
             raw=raw,
-            locality=locality_obj,
-            formatted=formatted,
-            latitude=latitude,
-            longitude=longitude,
+            locality_id=locality_id,
+            formatted=parts['formatted'],
+            latitude=parts['latitude'],
+            longitude=parts['longitude'],
             location=location
         )
 
-        # If "formatted" is empty try to construct it from other values.
-        if not address_obj.formatted:
-            address_obj.formatted = unicode(address_obj)
-
-        # Need to save.
+        # Need to save. An empty "formatted" is built from the other values.
         address_obj.save()
 
     # Done.
@@ -180,9 +385,7 @@ def to_python(value):
     # A string is considered a raw value.
     elif isinstance(value, basestring):
         logger.debug('Value is basestring, considered raw value')
-        obj = Address(raw=value)
-        obj.save()
-        return obj
+        return _raw_address(value)
 
     # A dictionary of named address components.
     elif isinstance(value, dict):
@@ -194,11 +397,260 @@ def to_python(value):
         except InconsistentDictError:
             logger.debug('InconsistentDict')
             logger.debug(InconsistentDictError)
-            return Address.objects.create(raw=value['raw'])
+            return _raw_address(value['raw'])
 
     # Not in any of the formats I recognise.
     raise ValidationError('Invalid address value.')
 
+def _label(address, locality=None):
+    # `locality` is a `(name, postal_code, state, country)` tuple from
+    # `_locality_labels`; the place is then written like `Locality.__str__`.
+    street = ' '.join(x for x in [address.street_number, address.route] if x)
+    if locality:
+        name, postal_code, state, country = locality
+        place = ', '.join(x for x in [name, state] if x)
+        if postal_code:
+            place += ' %s' % postal_code
+        label = ', '.join(x for x in [street, address.neigh, place.strip(), country] if x)
+    else:
+        label = ', '.join(x for x in [street, address.neigh, address.city, address.state] if x)
+        if address.zip_code:
+            label += ' - CEP: %s' % (format_cep(address.zip_code) or address.zip_code)
+    return label.strip(' ,-') or (address.raw or '')
+
+
+def _locality_labels(ids):
+    """Returns a dict mapping locality pks to their label values."""
+    labels = {}
+    for chunk in _chunks(set(pk for pk in ids if pk)):
+        rows = Locality.objects.filter(pk__in=chunk).values_list(
+            'pk', 'name', 'postal_code', 'state__code', 'state__name', 'state__country__name')
+        for pk, name, postal_code, state_code, state_name, country in rows:
+            labels[pk] = (name, postal_code, state_name or state_code or '', country or '')
+    return labels
+
+
+def set_labels(addresses, rebuild=False):
+    """Fills `formatted`, when empty or if `rebuild` is True, and `display`
+    on `addresses`, looking up their localities in one query. Used by every
+    path that writes addresses, so neither needs joins to be shown."""
+    labels = _locality_labels(address.locality_id for address in addresses)
+    formatted_length = Address._meta.get_field('formatted').max_length
+    display_length = Address._meta.get_field('display').max_length
+    for address in addresses:
+        if rebuild or not address.formatted:
+            address.formatted = _label(address)[:formatted_length]
+        address.display = _label(address, labels.get(address.locality_id))[:display_length]
+
+
+def rebuild_labels(addresses):
+    """Recomputes the labels of the addresses in the queryset `addresses`,
+    in batches, and writes those that changed. Returns how many did."""
+    updated = last_pk = 0
+    while True:
+        batch = list(addresses.filter(pk__gt=last_pk).order_by('pk')[:500])
+        if not batch:
+            return updated
+        last_pk = batch[-1].pk
+        before = [(address.formatted, address.display) for address in batch]
+        set_labels(batch)
+        changed = [address for address, old in zip(batch, before) if (address.formatted, address.display) != old]
+        Address.objects.bulk_update(changed, ['formatted', 'display'])
+        updated += len(changed)
+
+
+def _chunks(items, size=500):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _bulk_get_or_create(model, fields, keys, defaults=None):
+    """Returns a dict mapping each key in `keys` (tuples of values for
+    `fields`) to the pk of the matching `model` row, creating missing rows
+    with `bulk_create`. `defaults(key)` gives extra values for new rows.
+    """
+    def fetch(keys):
+        found = {}
+        for chunk in _chunks(keys):
+            query = reduce(operator.or_, (Q(**dict(zip(fields, key))) for key in chunk))
+            for row in model.objects.filter(query).values_list('pk', *fields):
+                found[tuple(row[1:])] = row[0]
+        return found
+
+    found = fetch(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        model.objects.bulk_create([
+            model(**dict(zip(fields, key), **(defaults(key) if defaults else {})))
+            for key in missing
+        ], ignore_conflicts=True)
+        found.update(fetch(missing))
+    return found
+
+
+def _unnamed_localities(postal_codes):
+    """Returns a dict mapping postal codes to the pks of the existing
+    localities `_resolve_hierarchy` finds for them when every name is empty,
+    with a few queries for all of them. No rows are created."""
+    if not postal_codes:
+        return {}
+    country_id = Country.objects.filter(name='').values_list('pk', flat=True).first()
+    state_id = State.objects.filter(name='', country_id=country_id).values_list('pk', flat=True).first()
+    found = {}
+    for chunk in _chunks(postal_codes):
+        rows = Locality.objects.filter(name='', state_id=state_id, postal_code__in=chunk).order_by('-pk')
+        found.update(rows.values_list('postal_code', 'pk'))
+    return found
+
+
+def to_python_many(values):
+    """Converts many address values at once, returning them in input order.
+
+    Values are handled like `to_python`. Dictionaries have their countries,
+    states and localities resolved or created with a few set based queries,
+    identical addresses within the batch share one object and new addresses
+    are inserted with `bulk_create`. Raw only values (strings and
+    inconsistent dictionaries) reuse an existing address with the same
+    `raw_key`. New addresses are not geocoded, so they are left for
+    `manage.py geocode_addresses`.
+
+    Dictionaries may carry their `raw_key` and, when inconsistent, a
+    `parsed` `ParsedAddress` of their raw value, worked out ahead of time
+    as `manage.py import_addresses` does in its worker processes.
+    """
+    values = list(values)
+    results = [None] * len(values)
+    entries = []
+
+    for i, value in enumerate(values):
+        if value is None or isinstance(value, (Address, int, long)):
+            results[i] = value
+        elif isinstance(value, basestring):
+            entries.append((i, dict(raw=value, locality='', street_number='', route='')))
+        elif isinstance(value, dict):
+            try:
+                parts = _parse(value)
+            except InconsistentDictError:
+                parts = dict(raw=value['raw'], locality='', street_number='', route='', parsed=value.get('parsed'))
+            if parts is not None:
+                if 'raw_key' in value:
+                    parts['raw_key'] = value['raw_key']
+                entries.append((i, parts))
+        else:
+            raise ValidationError('Invalid address value.')
+
+    with transaction.atomic():
+        # Countries, states and localities. The first code given for a new
+        # country or state is the one stored.
+        placed = [parts for i, parts in entries if parts.get('country')]
+        codes = {}
+        for parts in placed:
+            codes.setdefault((Country, parts['country']), parts['country_code'])
+            codes.setdefault((State, parts['state']), parts['state_code'])
+        countries = _bulk_get_or_create(
+            Country, ('name',), set((p['country'],) for p in placed),
+            lambda key: dict(code=_clean_code(Country, codes[(Country, key[0])], key[0])))
+        states = _bulk_get_or_create(
+            State, ('name', 'country_id'), set((p['state'], countries[(p['country'],)]) for p in placed),
+            lambda key: dict(code=_clean_code(State, codes[(State, key[0])], key[0])))
+        localities = _bulk_get_or_create(
+            Locality, ('name', 'postal_code', 'state_id'),
+            set((p['locality'], p['postal_code'], states[(p['state'], countries[(p['country'],)])])
+                for p in placed))
+        locality_index.add_many((pk, name, state_id) for (name, postal_code, state_id), pk in localities.items())
+
+        unnamed = _unnamed_localities(set(p['postal_code'] for i, p in entries
+                                          if 'country' in p and not p['country']))
+        for i, parts in entries:
+            if parts.get('country'):
+                state_id = states[(parts['state'], countries[(parts['country'],)])]
+                parts['locality_id'] = localities[(parts['locality'], parts['postal_code'], state_id)]
+            elif 'country' in parts:
+                parts['locality_id'] = unnamed.get(parts['postal_code'])
+            else:
+                parts['locality_id'] = None
+
+        # Addresses, keyed like the lookups `_to_python` does.
+        keyed = {}
+        for i, parts in entries:
+            key = canonical_key(parts['street_number'], parts['route'], parts['locality_id'],
+                                latitude=parts.get('latitude'), longitude=parts.get('longitude'))
+            parts['canonical_key'] = key
+            if 'raw_key' not in parts:
+                parts['raw_key'] = raw_key(parts['raw'])
+            if key is not None:
+                parts['key'] = key
+            elif parts['raw_key'] is not None:
+                parts['key'] = ('raw', parts['raw_key'])
+            else:
+                # Nothing to match on: always a new address.
+                parts['key'] = ('new', i)
+            keyed.setdefault(parts['key'], []).append(i)
+
+        existing = {}
+        raws = [key[1] for key in keyed if isinstance(key, tuple) and key[0] == 'raw']
+        for chunk in _chunks(raws):
+            for obj in Address.objects.filter(raw_key__in=chunk).order_by('-pk'):
+                existing[('raw', obj.raw_key)] = obj
+        keys = [key for key in keyed if not isinstance(key, tuple)]
+        for chunk in _chunks(keys):
+            for obj in Address.objects.filter(canonical_key__in=chunk).order_by('-pk'):
+                existing[obj.canonical_key] = obj
+
+        new, raw_only = [], []
+        for i, parts in entries:
+            key = parts['key']
+            if key in existing:
+                continue
+            obj = Address(
+                street_number=parts['street_number'],
+                route=parts['route'],
+                raw=parts['raw'],
+                locality_id=parts['locality_id'],
+                formatted=parts.get('formatted', ''),
+                latitude=parts.get('latitude'),
+                longitude=parts.get('longitude'),
+                location=parts.get('location'),
+                geohash=encode_geohash(parts.get('latitude'), parts.get('longitude')),
+                canonical_key=parts['canonical_key'],
+                raw_key=parts['raw_key'],
+            )
+            if 'country' not in parts:
+                raw_only.append((obj, parts.get('parsed')))
+            existing[key] = obj
+            new.append(obj)
+
+        # Raw only addresses get the components the parser finds in them.
+        if PARSE_RAW:
+            missing = [obj.raw for obj, parsed in raw_only if parsed is None]
+            found = iter(parse_many(missing) if missing else [])
+            raw_only = [(obj, parsed if parsed is not None else next(found)) for obj, parsed in raw_only]
+        for obj, parsed_address in raw_only:
+            for field, value in _parsed_fields(parsed_address).items():
+                setattr(obj, field, value)
+            obj.canonical_key = obj.make_canonical_key()
+        set_labels(new)
+
+        connection = connections[router.db_for_write(Address)]
+        if getattr(connection.features, 'can_return_rows_from_bulk_insert',
+                   getattr(connection.features, 'can_return_ids_from_bulk_insert', False)):
+            Address.objects.bulk_create(new)
+        else:
+            # Without pks coming back from bulk inserts, save one by one but
+            # skip `Address.save()` and its geocoding.
+            for obj in new:
+                super(Address, obj).save()
+        for obj in new:
+            obj._density_snapshot = density_key(obj)
+        record_changes([(None, obj._density_snapshot) for obj in new])
+        link_owners(new)
+        schedule_memberships(address_ids=[obj.pk for obj in new if obj.location is not None])
+
+    for i, parts in entries:
+        results[i] = existing[parts['key']]
+    return results
+
 ##
 # A country.
 ##
@@ -268,6 +720,85 @@ class Locality(models.Model):
             txt += ', %s' % cntry
         return txt
 
+def _geography(point):
+    # Accepts a `Point` or a `(latitude, longitude)` pair.
+    if not isinstance(point, Point):
+        latitude, longitude = point
+        point = Point(float(longitude), float(latitude), srid=4326)
+    elif point.srid is None:
+        point = Point(point.x, point.y, srid=4326)
+    return point
+
+
+class KNNDistance(models.Func):
+    """`location <-> point`: the distance in metres between a geography
+    column and a point, which PostGIS orders by walking the GiST index."""
+    arg_joiner = ' <-> '
+    template = '(%(expressions)s)'
+
+    def __init__(self, field, point):
+        point = models.Func(models.Value(_geography(point).ewkt), function='ST_GeogFromText')
+        super(KNNDistance, self).__init__(models.F(field), point, output_field=models.FloatField())
+
+
+class AddressQuerySet(models.QuerySet):
+
+    def with_hierarchy(self):
+        """Fetches the locality, state and country of each address in the
+        same query, so `as_dict()` and `str(address.locality)` don't query."""
+        return self.select_related('locality__state__country')
+
+    def nearest(self, point, k=10, max_distance=None):
+        """Returns the `k` addresses closest to `point` (a `Point` or a
+        `(latitude, longitude)` pair), nearest first, annotated with their
+        `distance` in metres. Uses the PostGIS KNN operator, so only the
+        index entries around `point` are visited. `max_distance`, in
+        metres, drops addresses further away."""
+        queryset = self.exclude(location=None)
+        if max_distance is not None:
+            queryset = queryset.filter(location__dwithin=(_geography(point), D(m=max_distance)))
+        return queryset.annotate(distance=KNNDistance('location', point)).order_by('distance')[:k]
+
+    def within_radius(self, point, meters):
+        """Returns the addresses within `meters` of `point`, nearest first,
+        annotated with their `distance` in metres. `ST_DWithin` first
+        matches the index bounding boxes against the circle's bounding box
+        and only measures the candidates left."""
+        return self.filter(location__dwithin=(_geography(point), D(m=meters))).annotate(
+            distance=KNNDistance('location', point)).order_by('distance')
+
+    def in_cells(self, cells):
+        """Returns the addresses inside any of the geohash `cells`, which
+        may have different lengths (see `address.geohash`). Each cell is a
+        prefix range scan of the `geohash` index."""
+        cells = merge_cells(cells)
+        if not cells:
+            return self.none()
+        return self.filter(reduce(operator.or_, [Q(geohash__startswith=cell) for cell in cells]))
+
+
+class AddressManager(models.Manager.from_queryset(AddressQuerySet)):
+    """The default `Address` manager. Pass `select_hierarchy=True`, or set
+    `ADDRESS_SELECT_HIERARCHY` for `Address.objects`, to apply
+    `with_hierarchy()` to every queryset."""
+
+    def __init__(self, select_hierarchy=False):
+        super(AddressManager, self).__init__()
+        self.select_hierarchy = select_hierarchy
+
+    def get_queryset(self):
+        queryset = super(AddressManager, self).get_queryset()
+        return queryset.with_hierarchy() if self.select_hierarchy else queryset
+
+    def get_cached(self, pk):
+        """Returns the `as_dict()` of the address `pk` through the address
+        cache (see `address.cache.AddressCache`)."""
+        return address_cache.get(pk)
+
+    def bulk_from_dicts(self, values):
+        """Converts many address dictionaries at once. See `to_python_many`."""
+        return to_python_many(values)
+
 ##
 # An address. If for any reason we are unable to find a matching
 # decomposed address we will store the raw address string in `raw`.
@@ -285,17 +816,74 @@ class Address(AuditMixin, geomodels.Model):
     locality = models.ForeignKey(Locality, on_delete=models.CASCADE, related_name='addresses', blank=True, null=True)
     raw = models.CharField(max_length=200, null=True, blank=True)
     formatted = models.CharField(max_length=200, blank=True)
+    display = models.CharField(max_length=255, blank=True, editable=False)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
 
     location = geomodels.PointField(verbose_name=_('local'), srid=4326, geography=True, null=True)
+    geohash = models.CharField(max_length=GEOHASH_LENGTH, blank=True, db_index=True, editable=False)
+    geocode_pending = models.BooleanField(default=False, db_index=True, editable=False)
+    canonical_key = models.CharField(max_length=40, blank=True, null=True, db_index=True, editable=False)
+    raw_key = models.CharField(max_length=40, blank=True, null=True, db_index=True, editable=False)
+
+    objects = AddressManager(select_hierarchy=SELECT_HIERARCHY)
 
     class Meta:
         verbose_name_plural = 'Addresses'
         ordering = ('locality', 'route', 'street_number')
         # unique_together = ('locality', 'route', 'street_number')
 
+    # Changes to any of these fields invalidate the stored coordinates.
+    geocode_fields = ('street_number', 'route', 'city', 'state', 'zip_code')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Address, cls).from_db(db, field_names, values)
+        instance._geocode_snapshot = instance._geocode_values()
+        instance._location_snapshot = instance._location_values()
+        instance._owner_snapshot = instance.__dict__.get(cls._meta.get_field('owner').attname)
+        if 'geohash' in instance.__dict__ and cls._meta.get_field('owner').attname in instance.__dict__:
+            instance._density_snapshot = density_key(instance)
+        return instance
+
+    def _stored_density(self):
+        # The `density_key` the row in the database counts for.
+        if hasattr(self, '_density_snapshot'):
+            return self._density_snapshot
+        if self.pk is None:
+            return None
+        owner = self._meta.get_field('owner').attname
+        row = type(self)._base_manager.filter(pk=self.pk).values_list('geohash', owner).first()
+        return (row[0], row[1] is not None) if row and row[0] else None
+
+    def _geocode_values(self):
+        # Read from __dict__ so deferred fields are not loaded here; they
+        # count as changed when the snapshot is compared.
+        return tuple(self.__dict__.get(f) for f in self.geocode_fields)
+
+    def _location_values(self):
+        location = self.__dict__.get('location')
+        if location is not None:
+            location = self.location
+            location = (location.x, location.y)
+        return location
+
+    def needs_geocode(self):
+        """Returns True if the address is new, has no location or any of
+        `geocode_fields` changed since it was loaded."""
+        snapshot = getattr(self, '_geocode_snapshot', None)
+        if snapshot is None or not self.location:
+            return True
+        return snapshot != tuple(getattr(self, f) for f in self.geocode_fields)
+
     def save(self, *args, **kwargs):
+        """Saves the address, geocoding it first when needed.
+
+        Pass `force_geocode=True` to look up the coordinates even if no
+        geocode relevant field has changed.
+        """
+        force_geocode = kwargs.pop('force_geocode', False)
+
         logger.debug('In save method Location is: ')
         logger.debug(self.location)
         logger.debug('trying saving')
@@ -308,22 +896,82 @@ class Address(AuditMixin, geomodels.Model):
 
         # TODO Use info to fetch lat lon from some service
         # check update_buyer_deliveryarearelation
-        # it receives buyer post_save signal and uses location, so location must be achieved before
-        # saving buyer below
-        geolocator = Nominatim(user_agent="cpm", timeout=5)
-        location = geolocator.geocode(self.geocode_query_str(), country_codes=['br'])
-        if location:
-            self.latitude, self.longitude = location.latitude, location.longitude
+        # it uses location, so location must be achieved before the buyer is
+        # linked below; with `address.owners.link_buyers` it should listen to
+        # `address.signals.buyer_address_changed` rather than buyer post_save
+        # With ADDRESS_GEOCODE_ASYNC the row is stored straight away and the
+        # lookup runs in a background worker after commit, which fills in the
+        # coordinates and sends `address.signals.address_geocoded`.
+        if not (force_geocode or self.needs_geocode()):
+            logger.debug('Geocode fields unchanged, skipping geocoding')
+        elif GEOCODE_ASYNC:
+            self.geocode_pending = True
+        else:
+            try:
+                coords = self.geocode()
+            except GeopyError as e:
+                # Don't lose the address because the geocoder is down.
+                logger.error('Unable to geocode address: %s', e)
+                coords = None
+            if coords:
+                self.latitude, self.longitude = coords
         if self.longitude and self.latitude:
             self.location = Point(self.longitude, self.latitude)
-
-        super(Address, self).save(*args, **kwargs)
-
-        # post save, set user's address to this
-        b = Buyer.objects.get(user=self.owner)
-        b.address = self
-        b.save()
-
+        self.geohash = encode_geohash(self.latitude, self.longitude)
+
+        self.canonical_key = self.make_canonical_key()
+        self.raw_key = raw_key(self.raw)
+        # A "formatted" built from the components is rebuilt when they change.
+        snapshot = getattr(self, '_geocode_snapshot', None)
+        set_labels([self], rebuild=snapshot is not None and snapshot != self._geocode_values())
+
+        owner_id = getattr(self, self._meta.get_field('owner').attname)
+        link_owner = self._state.adding or getattr(self, '_owner_snapshot', None) != owner_id
+        location = self._location_values()
+        moved = getattr(self, '_location_snapshot', None) != location
+        density = (self._stored_density(), density_key(self))
+
+        if density[0] != density[1]:
+            # The cell counts change along with the row.
+            with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Address, instance=self)):
+                super(Address, self).save(*args, **kwargs)
+                record_changes([density])
+        else:
+            super(Address, self).save(*args, **kwargs)
+        self._geocode_snapshot = self._geocode_values()
+        self._owner_snapshot = owner_id
+        self._location_snapshot = location
+        self._density_snapshot = density[1]
+
+        if self.geocode_pending:
+            from .tasks import schedule_geocode
+            schedule_geocode(self.pk)
+
+        # Post save, set the user's address to this one. See `address.owners`.
+        if link_owner:
+            link_owners([self])
+        if moved:
+            schedule_memberships(address_ids=[self.pk])
+
+    def make_canonical_key(self):
+        return canonical_key(self.street_number, self.route, self.locality_id, self.city, self.state,
+                             self.zip_code, self.latitude, self.longitude)
+
+    def resolve_location(self):
+        """Returns the `address.resolvers.GeocodeResult` for this address.
+
+        The geocoding stages in `ADDRESS_GEOCODE_STAGES` are tried in turn
+        until one answers; the result records the stage and its precision.
+        """
+        from .resolvers import resolve
+        return resolve(self)
+
+    def geocode(self):
+        """Returns `(latitude, longitude)` for this address, or `None`."""
+        result = self.resolve_location()
+        if result is None:
+            return None
+        return (result.latitude, result.longitude)
 
     def geocode_query_str(self):
         """Returns a seingle string suitable for geocoding"""
@@ -333,12 +981,7 @@ class Address(AuditMixin, geomodels.Model):
                                       ] if x])
 
     def __str__(self):
-        return ', '.join([x for x in [self.street_number+' '+self.route,
-                                      self.neigh,
-                                      self.city,
-                                      self.state,
-                                      ' - CEP: '+self.zip_code,
-                                      ] if x])
+        return self.display or _label(self)
 
 
     def as_dict(self):
@@ -347,6 +990,7 @@ class Address(AuditMixin, geomodels.Model):
             route=self.route,
             raw=self.raw,
             formatted=self.formatted,
+            display=self.display,
             latitude=self.latitude if self.latitude else '',
             longitude=self.longitude if self.longitude else '',
             location=self.location if self.location else None,
@@ -363,11 +1007,152 @@ class Address(AuditMixin, geomodels.Model):
         return ad
 
 
+##
+# A geocoding result, keyed by the normalized query string. Rows with no
+# coordinates record that the geocoder found nothing for the query.
+##
+
+
+class CachedGeocode(models.Model):
+    query = models.CharField(max_length=255, unique=True)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    updated = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.query
+
+    def value(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+        return (self.latitude, self.longitude)
+
+
+##
+# An area such as a delivery zone. Which addresses fall inside it is kept
+# in `AddressRegion` (see `address.regions`), so `region.addresses` and
+# `Address.objects.filter(regions=region)` don't need spatial predicates.
+##
+
+
+class Region(models.Model):
+    name = models.CharField(max_length=100)
+    kind = models.CharField(max_length=50, blank=True, db_index=True)
+    area = geomodels.MultiPolygonField(srid=4326, geography=True)
+    updated = models.DateTimeField(auto_now=True)
+    addresses = models.ManyToManyField(Address, through='AddressRegion', related_name='regions')
+
+    class Meta:
+        ordering = ('kind', 'name')
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Region, cls).from_db(db, field_names, values)
+        instance._area_snapshot = instance._area_value()
+        return instance
+
+    def _area_value(self):
+        area = self.__dict__.get('area')
+        return bytes(self.area.ewkb) if area is not None else None
+
+    def save(self, *args, **kwargs):
+        """Saves the region and, once committed, recomputes which addresses
+        it covers if the polygon is new or changed."""
+        area = self._area_value()
+        changed = self._state.adding or getattr(self, '_area_snapshot', None) != area
+        super(Region, self).save(*args, **kwargs)
+        self._area_snapshot = area
+        if changed:
+            schedule_memberships(region_ids=[self.pk])
+
+
+class AddressRegion(models.Model):
+    address = models.ForeignKey(Address, on_delete=models.CASCADE, related_name='region_memberships')
+    region = models.ForeignKey(Region, on_delete=models.CASCADE, related_name='memberships')
+
+    class Meta:
+        unique_together = ('region', 'address')
+
+    def __str__(self):
+        return '%s in %s' % (self.address_id, self.region_id)
+
+
+##
+# The number of addresses in a geohash cell, kept up to date by
+# `address.density`.
+##
+
+
+class CellDensity(models.Model):
+    cell = models.CharField(max_length=GEOHASH_LENGTH, unique=True)
+    length = models.PositiveSmallIntegerField(db_index=True)
+    addresses = models.IntegerField(default=0)
+    owned = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ('cell',)
+        verbose_name_plural = 'cell densities'
+
+    def __str__(self):
+        return '%s: %d' % (self.cell, self.addresses)
+
+
+class AddressPrefetchMixin(object):
+    """Queryset mixin that lets every instance of a result know its peers,
+    so `AddressDescriptor` can load their addresses together."""
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super(AddressPrefetchMixin, self)._fetch_all()
+        results = self._result_cache
+        if fetched and len(results) > 1 and isinstance(results[0], self.model):
+            peers = [weakref.ref(obj) for obj in results]
+            for obj in results:
+                obj._address_peers = peers
+
+
+_prefetch_querysets = {}
+
+
+def _install_prefetch(sender, **kwargs):
+    # Mix `AddressPrefetchMixin` into the querysets of the managers of
+    # models with an `AddressField` that prefetches.
+    if not any(isinstance(f, AddressField) and f.prefetch for f in sender._meta.local_fields):
+        return
+    for manager in sender._meta.local_managers:
+        base = manager._queryset_class
+        if not issubclass(base, AddressPrefetchMixin):
+            if base not in _prefetch_querysets:
+                _prefetch_querysets[base] = type(str('AddressPrefetch%s' % base.__name__),
+                                                 (AddressPrefetchMixin, base), {})
+            manager._queryset_class = _prefetch_querysets[base]
+
+
 class AddressDescriptor(ForwardManyToOneDescriptor):
 
+    def __get__(self, instance, cls=None):
+        # The first access to an address loads the addresses of all the
+        # instances fetched with this one, with their hierarchy, in one query.
+        if instance is not None and self.field.prefetch and not self.is_cached(instance):
+            self.prefetch_peers(instance)
+        return super(AddressDescriptor, self).__get__(instance, cls)
+
     def __set__(self, inst, value):
         super(AddressDescriptor, self).__set__(inst, to_python(value))
 
+    def prefetch_peers(self, instance):
+        attname = self.field.attname
+        peers = []
+        for ref in getattr(instance, '_address_peers', ()):
+            peer = ref()
+            if peer is not None and attname in peer.__dict__ and not self.is_cached(peer):
+                peers.append(peer)
+        if len(peers) > 1:
+            prefetch_related_objects(peers, Prefetch(self.field.name, queryset=Address.objects.with_hierarchy()))
+
 ##
 # A field for addresses in other models.
 ##
@@ -379,6 +1164,9 @@ class AddressField(models.ForeignKey):
     def __init__(self, *args, **kwargs):
         kwargs['to'] = 'address.Address'
         kwargs['on_delete'] = models.CASCADE
+        # Batch the loading of addresses across the instances of a queryset.
+        self._prefetch = kwargs.pop('prefetch', None)
+        self.prefetch = FIELD_PREFETCH if self._prefetch is None else self._prefetch
         super(AddressField, self).__init__(*args, **kwargs)
 
     def contribute_to_class(self, cls, name, virtual_only=False):
@@ -389,13 +1177,17 @@ class AddressField(models.ForeignKey):
 
         setattr(cls, self.name, AddressDescriptor(self))
 
-    # def deconstruct(self):
-    #     name, path, args, kwargs = super(AddressField, self).deconstruct()
-    #     del kwargs['to']
-    #     return name, path, args, kwargs
+    def deconstruct(self):
+        name, path, args, kwargs = super(AddressField, self).deconstruct()
+        if self._prefetch is not None:
+            kwargs['prefetch'] = self._prefetch
+        return name, path, args, kwargs
 
     def formfield(self, **kwargs):
         from .forms import AddressField as AddressFormField
         defaults = dict(form_class=AddressFormField)
         defaults.update(kwargs)
         return super(AddressField, self).formfield(**defaults)
+
+
+class_prepared.connect(_install_prefetch, dispatch_uid='address_prefetch')
@@ -0,0 +1,189 @@
+"""
+Normalization of Brazilian address strings.
+
+`normalize_address` folds accents and case, expands the usual abbreviations
+of street types and titles and canonicalizes spacing and punctuation, so
+"R. Augusta 100", "Rua Augusta, 100" and "RUA AUGUSTA 100" all become
+"rua augusta 100". All tables and patterns are built once at import time;
+`normalize_many` runs them over a list or column of values.
+"""
+import re
+import unicodedata
+
+__all__ = ['fold_accents', 'normalize_address', 'normalize_many', 'extract_cep', 'format_cep',
+           'state_name', 'state_uf', 'UF_STATES']
+
+UF_STATES = {
+    'AC': 'Acre',
+    'AL': 'Alagoas',
+    'AP': 'Amapá',
+    'AM': 'Amazonas',
+    'BA': 'Bahia',
+    'CE': 'Ceará',
+    'DF': 'Distrito Federal',
+    'ES': 'Espírito Santo',
+    'GO': 'Goiás',
+    'MA': 'Maranhão',
+    'MT': 'Mato Grosso',
+    'MS': 'Mato Grosso do Sul',
+    'MG': 'Minas Gerais',
+    'PA': 'Pará',
+    'PB': 'Paraíba',
+    'PR': 'Paraná',
+    'PE': 'Pernambuco',
+    'PI': 'Piauí',
+    'RJ': 'Rio de Janeiro',
+    'RN': 'Rio Grande do Norte',
+    'RS': 'Rio Grande do Sul',
+    'RO': 'Rondônia',
+    'RR': 'Roraima',
+    'SC': 'Santa Catarina',
+    'SP': 'São Paulo',
+    'SE': 'Sergipe',
+    'TO': 'Tocantins',
+}
+
+# Street types, only expanded at the start of a component and when a name
+# follows, so a lone "AL" (Alagoas) is left alone.
+STREET_TYPES = {
+    'r': 'rua',
+    'av': 'avenida',
+    'ave': 'avenida',
+    'al': 'alameda',
+    'trav': 'travessa',
+    'tv': 'travessa',
+    'pc': 'praca',
+    'pca': 'praca',
+    'rod': 'rodovia',
+    'estr': 'estrada',
+    'est': 'estrada',
+    'lg': 'largo',
+    'lgo': 'largo',
+    'lad': 'ladeira',
+    'pq': 'parque',
+    'vl': 'vila',
+    'jd': 'jardim',
+    'bc': 'beco',
+    'cond': 'condominio',
+    'conj': 'conjunto',
+    'qd': 'quadra',
+}
+
+# Titles and other words abbreviated anywhere in a name.
+WORDS = {
+    'dr': 'doutor',
+    'dra': 'doutora',
+    'prof': 'professor',
+    'profa': 'professora',
+    'eng': 'engenheiro',
+    'sen': 'senador',
+    'dep': 'deputado',
+    'gov': 'governador',
+    'pres': 'presidente',
+    'mal': 'marechal',
+    'gal': 'general',
+    'gen': 'general',
+    'cel': 'coronel',
+    'cap': 'capitao',
+    'ten': 'tenente',
+    'alm': 'almirante',
+    'cmte': 'comandante',
+    'fr': 'frei',
+    'sto': 'santo',
+    'sta': 'santa',
+    'nro': 'n',
+    'num': 'n',
+    'apto': 'apartamento',
+    'ap': 'apartamento',
+    'bl': 'bloco',
+}
+
+# Precomputed translation: accented Latin letters to their base letter and
+# punctuation to spaces. Hyphens are kept, they matter in CEPs and numbers.
+_FOLD = {}
+for _code in range(0xC0, 0x250):
+    _char = chr(_code)
+    _base = ''.join(c for c in unicodedata.normalize('NFKD', _char) if not unicodedata.combining(c))
+    if _base != _char and all(ord(c) < 128 for c in _base):
+        _FOLD[_code] = _base
+_FOLD.update({ord('º'): 'o', ord('ª'): 'a', ord('ß'): 'ss', ord('æ'): 'ae', ord('Æ'): 'AE',
+              ord('ø'): 'o', ord('Ø'): 'O', ord('œ'): 'oe', ord('Œ'): 'OE'})
+_ACCENTS = str.maketrans(_FOLD)
+_PUNCTUATION = str.maketrans({c: ' ' for c in '.,;:/\\()[]{}"\'`´!?#*_|'})
+
+_street_type_re = re.compile(r'^(%s)(?= \S)' % '|'.join(sorted(STREET_TYPES, key=len, reverse=True)))
+_words_re = re.compile(r'\b(%s)\b' % '|'.join(sorted(WORDS, key=len, reverse=True)))
+_cep_re = re.compile(r'(?<!\d)(\d{2})\.?(\d{3})-?(\d{3})(?!\d)')
+
+_states_by_name = dict((name.translate(_ACCENTS).lower(), uf) for uf, name in UF_STATES.items())
+
+
+def fold_accents(value):
+    return value.translate(_ACCENTS)
+
+
+def _expand_word(match):
+    return WORDS[match.group(1)]
+
+
+def _expand_street_type(match):
+    return STREET_TYPES[match.group(1)]
+
+
+def normalize_address(value):
+    """Returns the canonical form of an address string or component."""
+    if not value:
+        return ''
+    value = value.translate(_ACCENTS).lower()
+    # Commas separate components; the street type is only expanded at the
+    # start of one.
+    parts = []
+    for part in value.split(','):
+        part = ' '.join(t for t in part.translate(_PUNCTUATION).split() if t != '-')
+        if part:
+            part = _street_type_re.sub(_expand_street_type, part, 1)
+            parts.append(_words_re.sub(_expand_word, part))
+    return ' '.join(parts)
+
+
+def normalize_many(values):
+    """Normalizes every value of a list (or any iterable, such as a column
+    of a CSV file). Repeated values are only normalized once."""
+    seen = {}
+    result = []
+    append = result.append
+    get = seen.get
+    for value in values:
+        normalized = get(value)
+        if normalized is None:
+            normalized = seen[value] = normalize_address(value)
+        append(normalized)
+    return result
+
+
+def extract_cep(value):
+    """Returns the first CEP found in `value` as 8 digits, or ''."""
+    match = _cep_re.search(value or '')
+    if match is None:
+        return ''
+    return ''.join(match.groups())
+
+
+def format_cep(value):
+    """Formats a CEP as 00000-000. Returns '' if `value` holds no CEP."""
+    cep = extract_cep(value)
+    return '%s-%s' % (cep[:5], cep[5:]) if cep else ''
+
+
+def state_name(uf):
+    """Returns the name of the state with the abbreviation `uf`, or ''."""
+    return UF_STATES.get((uf or '').strip().upper(), '')
+
+
+def state_uf(value):
+    """Returns the abbreviation of a state given its name or abbreviation,
+    ignoring case and accents. Returns '' for unknown states."""
+    value = ' '.join((value or '').split())
+    if value.upper() in UF_STATES:
+        return value.upper()
+    return _states_by_name.get(value.translate(_ACCENTS).lower(), '')
@@ -0,0 +1,68 @@
+"""
+Pointing the `Buyer` profile of an address' owner at the address.
+
+`Address.save()` and `to_python_many` pass new addresses, and addresses
+whose owner changed, to the callable named by `ADDRESS_OWNER_LINK`
+(`link_buyers` by default, `None` to do nothing). It receives a list of
+addresses.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, IntegerField, When
+from django.utils.module_loading import import_string
+
+from .signals import buyer_address_changed
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['link_buyers', 'link_owners']
+
+OWNER_LINK = getattr(settings, 'ADDRESS_OWNER_LINK', 'address.owners.link_buyers')
+
+_link = None
+
+
+def _owner_id(address):
+    return getattr(address, address._meta.get_field('owner').attname, None)
+
+
+def link_buyers(addresses):
+    """Sets `Buyer.address` for the owners of `addresses` with a single
+    `UPDATE` once the current transaction commits. The buyers are not saved,
+    so receivers of their `post_save` don't run; `buyer_address_changed` is
+    sent instead. When an owner has several of the addresses, the last wins.
+    """
+    links = {}
+    for address in addresses:
+        owner_id = _owner_id(address)
+        if owner_id is not None and address.pk is not None:
+            links[owner_id] = address.pk
+    if links:
+        transaction.on_commit(lambda: _update_buyers(links))
+
+
+def _update_buyers(links):
+    from compramim.users.models import Buyer
+
+    buyers = Buyer.objects.filter(user_id__in=list(links))
+    if len(links) == 1:
+        (owner_id, address_id), = links.items()
+        updated = buyers.update(address_id=address_id)
+    else:
+        updated = buyers.update(address_id=Case(
+            *[When(user_id=owner_id, then=address_id) for owner_id, address_id in links.items()],
+            output_field=IntegerField()))
+    logger.debug('Linked %d buyers to their addresses', updated)
+    buyer_address_changed.send(sender=Buyer, links=links)
+
+
+def link_owners(addresses):
+    """Runs the `ADDRESS_OWNER_LINK` hook for `addresses`."""
+    global _link
+    if OWNER_LINK is None or not addresses:
+        return
+    if _link is None:
+        _link = import_string(OWNER_LINK)
+    _link(addresses)
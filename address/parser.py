@@ -0,0 +1,270 @@
+"""
+Offline parsing of free text Brazilian addresses.
+
+`parse_address` splits a string such as "Rua Augusta, 100 - apto 12 -
+Consolação, São Paulo/SP, 01305-000" into the components stored on
+`Address` and scores how much of it it could recognise. Cities are matched
+against the localities already in the database, through an in memory index
+kept up to date by the `Locality` and `State` signals.
+"""
+import re
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .normalize import STREET_TYPES, UF_STATES, extract_cep, fold_accents, normalize_address, state_uf
+
+__all__ = ['ParsedAddress', 'parse_address', 'parse_many', 'locality_index']
+
+MIN_CONFIDENCE = getattr(settings, 'ADDRESS_PARSER_MIN_CONFIDENCE', 0.5)
+
+# How much each recognised component adds to the confidence of a parse.
+WEIGHTS = {
+    'route': 0.3,
+    'street_number': 0.2,
+    'city': 0.25,
+    'state': 0.15,
+    'zip_code': 0.1,
+}
+
+# Components that are recognised with less certainty count for this much.
+GUESSED = 0.5
+
+_STREET_WORDS = frozenset(STREET_TYPES.values()) | frozenset([
+    'servidao', 'via', 'viela', 'passagem', 'ponte', 'praia', 'setor', 'caminho', 'acesso', 'marginal',
+])
+
+_cep_re = re.compile(r'(?:\bcep\b[\s:.]*)?(?<!\d)\d{2}\.?\d{3}-?\d{3}(?!\d)', re.I)
+_separator_re = re.compile(r'\s*(?:[,;|]|\s[-–]\s)\s*')
+_number_re = re.compile(r'^(?:(?:n[o°]?|nr|nro|num|numero)(?!\w)\.?\s*)?(\d+[a-z]?|s/?n)$')
+_trailing_number_re = re.compile(r'^(.*?\D)[\s.]*(?:\b(?:n[oº°]?|nr|nro|num|n[uú]mero)(?!\w)\.?\s*)?(\d+[a-z]?|s/?n)$',
+                                 re.I)
+_extra_re = re.compile(r'^(?:apto?|apartamento|bloco|bl|casa|sala|sl|loja|lj|andar|fundos|frente|'
+                       r'conj|conjunto|cj|lote|lt|box|terreo|sobreloja|km)\b')
+_city_state_re = re.compile(r'^(.*?\S)\s*(?:/|\s)\s*([a-zA-Z]{2})$')
+
+
+class ParsedAddress(namedtuple('ParsedAddress', 'route street_number extra neigh city state zip_code '
+                                                'locality_id confidence')):
+    """The components of a parsed address, with a confidence between 0 and 1.
+    Components that weren't found are empty strings."""
+
+    def as_fields(self):
+        """Returns the `Address` field values for this parse, cut to the
+        length of their columns."""
+        from .models import Address
+
+        fields = {}
+        for field in ('route', 'street_number', 'extra', 'neigh', 'city', 'state', 'zip_code'):
+            fields[field] = getattr(self, field)[:Address._meta.get_field(field).max_length].strip()
+        fields['extra'] = fields['extra'] or None
+        if self.locality_id is not None:
+            fields['locality_id'] = self.locality_id
+        return fields
+
+##
+# City names of the localities in the database, normalized, with the
+# abbreviation of their state. Loaded on first use.
+##
+
+
+class LocalityIndex(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = None
+        self._states = None
+
+    def load(self):
+        """Loads the index from the database, returning `(names, states)`."""
+        from .models import Locality, State
+
+        states = {}
+        for pk, code, name in State.objects.values_list('pk', 'code', 'name'):
+            states[pk] = state_uf(code) or state_uf(name)
+        names = {}
+        rows = Locality.objects.exclude(name='').order_by('pk').values_list('pk', 'name', 'state_id')
+        for pk, name, state_id in rows.iterator():
+            self._add(names, pk, name, states.get(state_id, ''))
+        with self._lock:
+            self._names, self._states = names, states
+        return names, states
+
+    def use(self, names, states):
+        """Installs `(names, states)` from `load()` in another process, so
+        parsing there doesn't need the database."""
+        with self._lock:
+            self._names, self._states = names, states
+
+    @staticmethod
+    def _add(names, pk, name, uf):
+        entries = names.setdefault(normalize_address(name), [])
+        if not any(entry[2] == uf for entry in entries):
+            entries.append((pk, name, uf))
+
+    def get(self, name, uf=''):
+        """Returns `(pk, name, uf)` for the locality called `name`, in the
+        state `uf` if given, or None. Names are compared normalized."""
+        # `invalidate()` may run in another thread at any point, so the
+        # index is only read through a local reference.
+        names = self._names
+        if names is None:
+            names = self.load()[0]
+        entries = names.get(normalize_address(name))
+        if not entries:
+            return None
+        if uf:
+            for entry in entries:
+                if entry[2] == uf:
+                    return entry
+            return None
+        return entries[0] if len(entries) == 1 else None
+
+    def add(self, locality):
+        """Adds a locality once the current transaction commits."""
+        self.add_many([(locality.pk, locality.name, locality.state_id)])
+
+    def add_many(self, rows):
+        """Adds `(pk, name, state_id)` rows once the current transaction
+        commits, for localities created without `post_save`. Rows already in
+        the index are left alone."""
+        rows = [row for row in rows if row[0] is not None and row[1]]
+        if rows:
+            transaction.on_commit(lambda: self._add_committed(rows))
+
+    def _add_committed(self, rows):
+        with self._lock:
+            if self._names is None:
+                return
+            for pk, name, state_id in rows:
+                if state_id not in self._states:
+                    # A new state; reload everything on next use.
+                    self._names = self._states = None
+                    return
+                self._add(self._names, pk, name, self._states[state_id])
+
+    def invalidate(self):
+        with self._lock:
+            self._names = self._states = None
+
+
+locality_index = LocalityIndex()
+
+
+def _split(raw):
+    """Returns `(zip_code, components)` for a raw address string."""
+    zip_code = extract_cep(raw)
+    if zip_code:
+        raw = _cep_re.sub(',', raw, 1)
+    components = [c.strip(' .-') for c in _separator_re.split(raw)]
+    return zip_code, [c for c in components if c]
+
+
+def _key(component):
+    return fold_accents(component).lower()
+
+
+def parse_address(raw, localities=None):
+    """Parses the free text address `raw`, returning a `ParsedAddress`.
+
+    The parse works offline: the only reference data used is the index of
+    localities in the database (`localities`, the shared index by default).
+    """
+    if localities is None:
+        localities = locality_index
+    parsed = dict(route='', street_number='', extra='', neigh='', city='', state='', zip_code='',
+                  locality_id=None)
+    score = 0.0
+    zip_code, components = _split(' '.join((raw or '').split()))
+    if zip_code:
+        parsed['zip_code'] = zip_code
+        score += WEIGHTS['zip_code']
+
+    # The state comes last, on its own or after the city ("São Paulo/SP").
+    city = None
+    if components:
+        uf = state_uf(components[-1])
+        if uf:
+            # Some states share their name with their capital: it is the
+            # city unless a city of that state precedes it.
+            if (len(components[-1]) > 2 and localities.get(components[-1], uf) and
+                    not (len(components) > 1 and localities.get(components[-2], uf))):
+                city = components[-1]
+            components.pop()
+        else:
+            match = _city_state_re.match(components[-1])
+            if match and match.group(2).upper() in UF_STATES and not _extra_re.match(_key(match.group(1))):
+                uf = match.group(2).upper()
+                city = match.group(1)
+                components.pop()
+        if uf:
+            parsed['state'] = uf
+            score += WEIGHTS['state']
+
+    # The city is a known locality near the end, or whatever precedes the state.
+    if city is None:
+        for i in range(len(components) - 1, max(len(components) - 3, 0) - 1, -1):
+            if localities.get(components[i], parsed['state']):
+                city = components.pop(i)
+                break
+        else:
+            if parsed['state'] and len(components) > 1:
+                city = components.pop()
+    if city is not None:
+        locality = localities.get(city, parsed['state'])
+        if locality is not None:
+            parsed['locality_id'], parsed['city'] = locality[0], locality[1]
+            parsed['state'] = parsed['state'] or locality[2]
+            score += WEIGHTS['city']
+        else:
+            parsed['city'] = city
+            score += WEIGHTS['city'] * GUESSED
+
+    # Street, number, complement and neighbourhood, left to right.
+    rest = []
+    guessed_route = False
+    for component in components:
+        key = _key(component)
+        number = _number_re.match(key)
+        if number and not parsed['street_number']:
+            parsed['street_number'] = component[-len(number.group(1)):]
+        elif _extra_re.match(key):
+            parsed['extra'] = ' '.join(filter(None, [parsed['extra'], component]))
+        elif not parsed['route'] and normalize_address(component).split(' ', 1)[0] in _STREET_WORDS:
+            parsed['route'] = component
+        else:
+            rest.append(component)
+    if not parsed['route'] and rest and any(c.isalpha() for c in rest[0]):
+        parsed['route'] = rest.pop(0)
+        guessed_route = True
+    if not parsed['street_number'] and parsed['route']:
+        match = _trailing_number_re.match(parsed['route'])
+        if match and len(match.group(1).split()) > 1:
+            parsed['route'] = match.group(1).strip(' ,.-')
+            parsed['street_number'] = match.group(2)
+    if rest:
+        parsed['neigh'] = rest[0]
+    if parsed['route']:
+        score += WEIGHTS['route'] * (GUESSED if guessed_route else 1)
+    if parsed['street_number']:
+        score += WEIGHTS['street_number']
+
+    parsed['confidence'] = round(min(score, 1.0), 2)
+    return ParsedAddress(**parsed)
+
+
+def parse_many(raws):
+    """Parses a list of raw addresses, returning a `ParsedAddress` for each.
+    The locality index is loaded once and repeated values parsed once."""
+    if locality_index._names is None:
+        locality_index.load()
+    seen = {}
+    result = []
+    for raw in raws:
+        parsed = seen.get(raw)
+        if parsed is None:
+            parsed = seen[raw] = parse_address(raw)
+        result.append(parsed)
+    return result
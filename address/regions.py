@@ -0,0 +1,82 @@
+"""
+Membership of addresses in `Region` polygons, stored in `AddressRegion`.
+
+Memberships are computed in the database with one `ST_Covers` join per
+refresh, limited to the addresses that moved or the regions whose polygon
+changed, so asking which addresses (or buyers) are inside a region is an
+indexed lookup on `AddressRegion`. The join needs PostGIS; on any other
+database nothing is written.
+"""
+import logging
+
+from django.db import connections, router, transaction
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['refresh_memberships', 'schedule_memberships']
+
+_DELETE_SQL = 'DELETE FROM {membership} WHERE {column} = ANY(%s)'
+
+_INSERT_SQL = '''
+    INSERT INTO {membership} ({address_column}, {region_column})
+    SELECT a.{address_pk}, r.{region_pk}
+      FROM {region} r
+      JOIN {address} a ON ST_Covers(r.{area}, a.{location})
+     WHERE {condition}
+    ON CONFLICT DO NOTHING
+'''
+
+
+def refresh_memberships(address_ids=None, region_ids=None):
+    """Recomputes the regions of the addresses `address_ids`, or the
+    addresses of the regions `region_ids`. With neither, every membership
+    is rebuilt. Returns the number of memberships written."""
+    from .models import Address, AddressRegion, Region
+
+    if address_ids is not None and region_ids is not None:
+        raise ValueError('Refresh either addresses or regions, not both.')
+    using = router.db_for_write(AddressRegion)
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        logger.debug('Address region memberships need PostGIS, not %s', connection.vendor)
+        return 0
+    quote = connection.ops.quote_name
+    names = dict((name, quote(model._meta.db_table)) for name, model in (
+        ('membership', AddressRegion), ('region', Region), ('address', Address)))
+    names.update((name, quote(column)) for name, column in (
+        ('address_column', AddressRegion._meta.get_field('address').column),
+        ('region_column', AddressRegion._meta.get_field('region').column),
+        ('address_pk', Address._meta.pk.column),
+        ('region_pk', Region._meta.pk.column),
+        ('area', Region._meta.get_field('area').column),
+        ('location', Address._meta.get_field('location').column)))
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if address_ids is None and region_ids is None:
+            cursor.execute('DELETE FROM {membership}'.format(**names))
+            cursor.execute(_INSERT_SQL.format(condition='a.{location} IS NOT NULL'.format(**names), **names))
+        else:
+            if address_ids is not None:
+                column, condition, ids = names['address_column'], 'a.{address_pk} = ANY(%s)', address_ids
+            else:
+                column, condition, ids = names['region_column'], 'r.{region_pk} = ANY(%s)', region_ids
+            ids = list(set(ids))
+            if not ids:
+                return 0
+            cursor.execute(_DELETE_SQL.format(column=column, **names), [ids])
+            cursor.execute(_INSERT_SQL.format(condition=condition.format(**names), **names), [ids])
+        written = cursor.rowcount
+    logger.debug('Wrote %d address region memberships', written)
+    return written
+
+
+def schedule_memberships(address_ids=None, region_ids=None):
+    """Runs `refresh_memberships` once the current transaction commits."""
+    address_ids = list(address_ids) if address_ids is not None else None
+    region_ids = list(region_ids) if region_ids is not None else None
+    if address_ids == [] or region_ids == []:
+        return
+    from .models import AddressRegion
+
+    transaction.on_commit(lambda: refresh_memberships(address_ids=address_ids, region_ids=region_ids),
+                          using=router.db_for_write(AddressRegion))
@@ -0,0 +1,132 @@
+"""
+Geocoding stages for `Address.resolve_location()`.
+
+A stage is a callable taking an address and a time budget in seconds and
+returning a `GeocodeResult`, or `None` to hand over to the next stage. Stages
+are tried in the order given by `ADDRESS_GEOCODE_STAGES`, a list of
+`(dotted path, budget)` pairs, and the first answer wins. Network stages keep
+their answers, including failures, in the geocode cache.
+"""
+import logging
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from geopy.exc import GeopyError
+
+from .cache import geocode_cache, MISS
+from .cep import lookup_cep
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['GeocodeResult', 'resolve', 'cep_centroid', 'structured', 'free_text', 'locality_centroid']
+
+# From most to least precise.
+STREET = 'street'
+POSTAL_CODE = 'postal_code'
+LOCALITY = 'locality'
+
+GeocodeResult = namedtuple('GeocodeResult', 'latitude longitude stage precision')
+
+DEFAULT_STAGES = [
+    ('address.resolvers.cep_centroid', None),
+    ('address.resolvers.structured', 3.0),
+    ('address.resolvers.locality_centroid', 1.5),
+]
+
+_stages = None
+
+
+def get_stages():
+    global _stages
+    if _stages is None:
+        _stages = [
+            (import_string(path), budget)
+            for path, budget in getattr(settings, 'ADDRESS_GEOCODE_STAGES', DEFAULT_STAGES)
+        ]
+    return _stages
+
+
+def _query(key, query, timeout):
+    """Geocodes `query` through the cache. Returns `(lat, lng)` or `None`."""
+    from .geocoder import get_client
+
+    coords = geocode_cache.get(key)
+    if coords is MISS:
+        location = get_client().geocode(query, timeout=timeout, country_codes=['br'])
+        coords = (location.latitude, location.longitude) if location else None
+        geocode_cache.set(key, coords)
+    return coords
+
+
+def _place(address):
+    """Returns the city, state and CEP of `address`. Addresses created from
+    components keep them in their locality instead of the plain fields."""
+    city, state, zip_code = address.city, address.state, address.zip_code
+    if not (city or state or zip_code) and address.locality_id:
+        locality = address.locality
+        city, state, zip_code = locality.name, locality.state.name or locality.state.code, locality.postal_code
+    return city, state, zip_code
+
+
+def cep_centroid(address, timeout):
+    record = lookup_cep(_place(address)[2])
+    if record and record.latitude is not None and record.longitude is not None:
+        return GeocodeResult(record.latitude, record.longitude, 'cep_centroid', POSTAL_CODE)
+
+
+def structured(address, timeout):
+    street = ' '.join(x for x in [address.street_number, address.route] if x)
+    if not street:
+        return None
+    city, state, zip_code = _place(address)
+    query = dict(street=street, city=city, state=state, postalcode=zip_code, country='Brasil')
+    query = dict((k, v) for k, v in query.items() if v)
+    key = 'structured: ' + ', '.join(query[k] for k in sorted(query))
+    coords = _query(key, query, timeout)
+    if coords:
+        return GeocodeResult(coords[0], coords[1], 'structured', STREET)
+
+
+def free_text(address, timeout):
+    query = address.geocode_query_str()
+    if not query:
+        return None
+    coords = _query(query, query, timeout)
+    if coords:
+        return GeocodeResult(coords[0], coords[1], 'free_text', STREET)
+
+
+def locality_centroid(address, timeout):
+    city, state, zip_code = _place(address)
+    if not city:
+        return None
+    query = dict(city=city, state=state, country='Brasil')
+    query = dict((k, v) for k, v in query.items() if v)
+    key = 'locality: ' + ', '.join(query[k] for k in sorted(query))
+    coords = _query(key, query, timeout)
+    if coords:
+        return GeocodeResult(coords[0], coords[1], 'locality_centroid', LOCALITY)
+
+
+def resolve(address, stages=None):
+    """Runs `address` through the geocoding stages.
+
+    Returns the first `GeocodeResult`, or `None`. If no stage answered and
+    one of them failed with a geocoder error, that error is raised so callers
+    can retry later.
+    """
+    error = None
+    for stage, budget in (stages if stages is not None else get_stages()):
+        try:
+            result = stage(address, budget)
+        except GeopyError as e:
+            logger.debug('Geocoding stage %s failed: %s', stage.__name__, e)
+            error = e
+            continue
+        if result is not None:
+            return result
+    if error is not None:
+        raise error
+    return None
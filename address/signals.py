@@ -0,0 +1,84 @@
+from django.dispatch import Signal
+
+from .cache import address_cache, hierarchy_cache
+from .density import density_key, record_changes
+from .parser import locality_index
+
+# Sent by the background geocoder once an address with a pending geocode
+# has been processed. Receivers get `instance` and `success` arguments.
+address_geocoded = Signal()
+
+# Sent by `address.owners.link_buyers` after buyers were pointed at new
+# addresses, with a `links` argument mapping user pks to address pks. Use it
+# for work that used to hang off the buyer's `post_save`.
+buyer_address_changed = Signal()
+
+
+def invalidate_hierarchy(sender, instance, **kwargs):
+    hierarchy_cache.invalidate(sender, instance.pk)
+
+
+def update_locality_index(sender, instance, created=False, **kwargs):
+    # New localities are added to the parser's index; renames, deletions and
+    # state changes make it reload.
+    if created and sender._meta.model_name == 'locality':
+        locality_index.add(instance)
+    else:
+        locality_index.invalidate()
+
+
+def invalidate_address(sender, instance, **kwargs):
+    address_cache.invalidate(instance.pk)
+
+
+def update_density(sender, instance, **kwargs):
+    # Deleted addresses leave their cells. Collected instances are loaded
+    # from the database, so the snapshot is what the row counted for.
+    old = instance._density_snapshot if hasattr(instance, '_density_snapshot') else density_key(instance)
+    record_changes([(old, None)])
+
+
+# The fields of countries, states and localities that addresses show in
+# their `display` label.
+LABEL_FIELDS = {
+    'country': ('name',),
+    'state': ('name', 'code', 'country_id'),
+    'locality': ('name', 'postal_code', 'state_id'),
+}
+
+# How to find the addresses of a country, state or locality.
+_ADDRESS_LOOKUPS = {
+    'country': 'locality__state__country',
+    'state': 'locality__state',
+    'locality': 'locality',
+}
+
+
+def _label_values(sender, instance):
+    return tuple(getattr(instance, field) for field in LABEL_FIELDS[sender._meta.model_name])
+
+
+def remember_labels(sender, instance, **kwargs):
+    # The stored values, to tell in `post_save` whether the labels changed.
+    fields = LABEL_FIELDS[sender._meta.model_name]
+    instance._stored_labels = sender._default_manager.filter(pk=instance.pk).values_list(*fields).first() \
+        if instance.pk is not None else None
+
+
+def update_labels(sender, instance, created=False, **kwargs):
+    # Addresses store the names of their place in `display`, so a rename
+    # rewrites the labels of the addresses in it.
+    from .models import Address, rebuild_labels
+
+    stored = getattr(instance, '_stored_labels', None)
+    if created or stored is None or stored == _label_values(sender, instance):
+        return
+    rebuild_labels(Address.objects.filter(**{_ADDRESS_LOOKUPS[sender._meta.model_name]: instance.pk}))
+
+
+def invalidate_addresses(sender, created=False, **kwargs):
+    # Cached addresses carry the names of their country, state and locality.
+    # None of them can refer to a row that was just created.
+    if created:
+        return
+    address_cache.bump()
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from geopy.exc import GeopyError
+
+from .cache import address_cache
+from .density import density_key, record_changes
+from .geohash import encode as encode_geohash
+from .regions import schedule_memberships
+from .signals import address_geocoded
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['schedule_geocode', 'geocode_address']
+
+GEOCODE_WORKERS = getattr(settings, 'ADDRESS_GEOCODE_WORKERS', 2)
+GEOCODE_RETRIES = getattr(settings, 'ADDRESS_GEOCODE_RETRIES', 3)
+GEOCODE_BACKOFF = getattr(settings, 'ADDRESS_GEOCODE_BACKOFF', 1.0)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=GEOCODE_WORKERS)
+        return _executor
+
+
+def geocode_address(pk, retries=GEOCODE_RETRIES, backoff=GEOCODE_BACKOFF):
+    """Geocodes the address `pk` and stores its coordinates.
+
+    Geocoder errors are retried with exponential backoff. The row is written
+    with `update()`, so none of the `Address.save()` side effects run again,
+    and only if it is still pending with the values that were geocoded; an
+    address edited or geocoded by another worker in the meantime is left
+    alone. Returns `True` when coordinates were found and stored.
+    """
+    from django.contrib.gis.geos import Point
+    from .models import Address
+
+    try:
+        address = Address.objects.get(pk=pk)
+    except Address.DoesNotExist:
+        logger.debug('Address %s vanished before it could be geocoded', pk)
+        return False
+    if not address.geocode_pending:
+        logger.debug('Address %s was already geocoded', pk)
+        return False
+    # What the lookup and the cell counts are based on.
+    owner = Address._meta.get_field('owner').attname
+    stored = dict((f, getattr(address, f)) for f in address.geocode_fields + ('locality_id', 'geohash', owner))
+
+    coords = None
+    for attempt in range(retries + 1):
+        try:
+            coords = address.geocode()
+            break
+        except GeopyError as e:
+            if attempt == retries:
+                logger.error('Giving up geocoding address %s: %s', pk, e)
+                break
+            delay = backoff * (2 ** attempt)
+            logger.debug('Geocoding address %s failed (%s), retrying in %ss', pk, e, delay)
+            time.sleep(delay)
+
+    fields = dict(geocode_pending=False)
+    if coords:
+        address.latitude, address.longitude = coords
+        address.location = Point(address.longitude, address.latitude)
+        address.geohash = encode_geohash(address.latitude, address.longitude)
+        fields.update(latitude=address.latitude, longitude=address.longitude, location=address.location,
+                      geohash=address.geohash)
+    with transaction.atomic():
+        updated = Address.objects.filter(pk=pk, geocode_pending=True, **stored).update(**fields)
+        if updated and coords:
+            record_changes([(address._density_snapshot, density_key(address))])
+            address._density_snapshot = density_key(address)
+    if not updated:
+        logger.debug('Address %s changed while it was geocoded, dropping the result', pk)
+        return False
+    address_cache.invalidate(pk)
+    if coords:
+        schedule_memberships(address_ids=[pk])
+    address.geocode_pending = False
+
+    address_geocoded.send(sender=Address, instance=address, success=bool(coords))
+    return bool(coords)
+
+
+def _run(pk):
+    try:
+        geocode_address(pk)
+    except Exception:
+        logger.exception('Unexpected error geocoding address %s', pk)
+    finally:
+        connection.close()
+
+
+def schedule_geocode(pk):
+    """Queues address `pk` for geocoding once the current transaction commits."""
+    transaction.on_commit(lambda: _get_executor().submit(_run, pk))
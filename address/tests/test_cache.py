@@ -0,0 +1,146 @@
+import time
+from datetime import timedelta
+
+from django.test import TestCase
+
+from address.cache import GeocodeCache, HierarchyCache, MISS, address_cache, hierarchy_cache, normalize_query
+from address.models import Address, CachedGeocode, Country, Locality, State, to_python_many
+
+
+class NormalizeQueryTestCase(TestCase):
+
+    def test_case_accents_and_spaces(self):
+        self.assertEqual(normalize_query('  100 R.  Augusta ,São Paulo,SP '),
+                         '100 rua augusta sao paulo sp')
+
+    def test_empty(self):
+        self.assertEqual(normalize_query(None), '')
+
+
+class GeocodeCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = GeocodeCache(maxsize=2, ttl=60, negative_ttl=10)
+
+    def test_miss_then_hit(self):
+        self.assertIs(self.cache.get('100 Rua Augusta, São Paulo'), MISS)
+        self.cache.set('100 Rua Augusta, São Paulo', (-23.55, -46.65))
+        self.assertEqual(self.cache.get('100 rua augusta,  sao paulo'), (-23.55, -46.65))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_negative_result(self):
+        self.cache.set('Nowhere', None)
+        self.assertIsNone(self.cache.get('Nowhere'))
+        self.assertIsNone(CachedGeocode.objects.get(query='nowhere').value())
+
+    def test_database_tier(self):
+        self.cache.set('1 Rua A', (1.0, 2.0))
+        other = GeocodeCache()
+        self.assertEqual(other.get('1 Rua A'), (1.0, 2.0))
+        self.assertEqual(other.stats()['db_hits'], 1)
+
+    def test_lru_bound(self):
+        for i in range(5):
+            self.cache.set('%d Rua A' % i, (i, i))
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+    def test_ttl(self):
+        self.cache.set('1 Rua A', None)
+        CachedGeocode.objects.filter(query='1 rua a').update(
+            updated=CachedGeocode.objects.get(query='1 rua a').updated - timedelta(seconds=11))
+        self.cache.clear()
+        self.assertIs(self.cache.get('1 Rua A'), MISS)
+
+
+class HierarchyCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = HierarchyCache()
+
+    def test_set_get_invalidate(self):
+        self.cache._set(Country, 1, ('Brasil',))
+        self.cache._set(State, 2, ('São Paulo', 1))
+        self.assertEqual(self.cache.get(Country, 'Brasil'), 1)
+        self.assertEqual(self.cache.get(State, 'São Paulo', 1), 2)
+        self.cache.invalidate(Country, 1)
+        self.assertIsNone(self.cache.get(Country, 'Brasil'))
+        self.assertEqual(self.cache.get(State, 'São Paulo', 1), 2)
+
+    def test_uncommitted_rows_not_cached(self):
+        self.cache.set(Country, 1, 'Brasil')
+        self.assertIsNone(self.cache.get(Country, 'Brasil'))
+
+    def test_signals(self):
+        country = Country.objects.create(name='Brasil', code='BR')
+        hierarchy_cache._set(Country, country.pk, ('Brasil',))
+        country.delete()
+        self.assertIsNone(hierarchy_cache.get(Country, 'Brasil'))
+
+    def test_warm(self):
+        country = Country.objects.create(name='Brasil', code='BR')
+        State.objects.create(name='São Paulo', code='SP', country=country)
+        self.cache.warm()
+        self.assertEqual(self.cache.get(Country, 'Brasil'), country.pk)
+        self.assertIsNotNone(self.cache.get(State, 'São Paulo', country.pk))
+
+
+class AddressCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.address = to_python_many([{
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU',
+        }])[0]
+        address_cache.cache.clear()
+
+    def test_cached(self):
+        with self.assertNumQueries(1):
+            ad = Address.objects.get_cached(self.address.pk)
+        self.assertEqual(ad['locality'], 'Northcote')
+        self.assertEqual(ad['country'], 'Australia')
+        with self.assertNumQueries(0):
+            self.assertEqual(Address.objects.get_cached(self.address.pk), ad)
+
+    def test_missing(self):
+        self.assertRaises(Address.DoesNotExist, Address.objects.get_cached, 0)
+
+    def test_invalidate(self):
+        Address.objects.get_cached(self.address.pk)
+        Address.objects.filter(pk=self.address.pk).update(route='Other Street')
+        address_cache.invalidate(self.address.pk)
+        self.assertEqual(Address.objects.get_cached(self.address.pk)['route'], 'Other Street')
+
+    def test_hierarchy_change(self):
+        Address.objects.get_cached(self.address.pk)
+        locality = Locality.objects.get(pk=self.address.locality_id)
+        locality.name = 'Northcote North'
+        locality.save()
+        self.assertEqual(Address.objects.get_cached(self.address.pk)['locality'], 'Northcote North')
+
+    def test_delete(self):
+        Address.objects.get_cached(self.address.pk)
+        pk = self.address.pk
+        self.address.delete()
+        self.assertRaises(Address.DoesNotExist, Address.objects.get_cached, pk)
+
+    def test_new_hierarchy_keeps_entries(self):
+        Address.objects.get_cached(self.address.pk)
+        Locality.objects.create(name='Fitzroy', state_id=Locality.objects.get(pk=self.address.locality_id).state_id)
+        with self.assertNumQueries(0):
+            Address.objects.get_cached(self.address.pk)
+
+    def test_generation_evicted(self):
+        Address.objects.get_cached(self.address.pk)
+        Address.objects.filter(pk=self.address.pk).update(route='Other Street')
+        address_cache.cache.delete(address_cache.generation_key, version=address_cache.version)
+        time.sleep(0.002)
+        # The counter restarts somewhere the cached entry wasn't tagged with.
+        self.assertEqual(Address.objects.get_cached(self.address.pk)['route'], 'Other Street')
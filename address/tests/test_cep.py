@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from address import cep
+from address.cep import CepIndex, CepRecord, build_index, clean_cep, lookup_cep
+
+
+class CepIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cep.idx')
+        build_index([
+            CepRecord('01310-100', 'Avenida Paulista', 'Bela Vista', 'São Paulo', 'SP', -23.5614, -46.6559),
+            CepRecord('20040-002', 'Avenida Rio Branco', 'Centro', 'Rio de Janeiro', 'RJ', '', ''),
+            CepRecord('01305-000', 'Rua Augusta', 'Consolação', 'São Paulo', 'SP', -23.5527, -46.6534),
+            CepRecord('123', 'Invalid', '', '', '', '', ''),
+        ], self.path)
+        self.index = CepIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        cep._index = cep._failed = None
+        shutil.rmtree(self.dir)
+
+    def test_clean_cep(self):
+        self.assertEqual(clean_cep('01310-100'), '01310100')
+        self.assertEqual(clean_cep('1234'), '')
+
+    def test_lookup(self):
+        self.assertEqual(len(self.index), 3)
+        record = self.index.lookup('01310100')
+        self.assertEqual(record.street, 'Avenida Paulista')
+        self.assertEqual(record.city, 'São Paulo')
+        self.assertAlmostEqual(record.latitude, -23.5614, places=4)
+        self.assertEqual(self.index.lookup('01305-000').neigh, 'Consolação')
+
+    def test_lookup_without_coordinates(self):
+        record = self.index.lookup('20040002')
+        self.assertEqual(record.state, 'RJ')
+        self.assertIsNone(record.latitude)
+
+    def test_lookup_missing(self):
+        self.assertIsNone(self.index.lookup('99999999'))
+        self.assertIsNone(self.index.lookup('abc'))
+
+    def test_lookup_cep_setting(self):
+        self.assertIsNone(lookup_cep('01310100'))
+        with override_settings(ADDRESS_CEP_INDEX=self.path):
+            self.assertEqual(lookup_cep('01310100').state, 'SP')
+
+    def test_missing_index_logged_once(self):
+        path = os.path.join(self.dir, 'missing.idx')
+        with override_settings(ADDRESS_CEP_INDEX=path):
+            with self.assertLogs('address.cep', 'ERROR') as logs:
+                self.assertIsNone(lookup_cep('01310100'))
+                self.assertIsNone(lookup_cep('01310100'))
+            self.assertEqual(len(logs.output), 1)
+            # Tried again once the file is there.
+            shutil.copy(self.path, path)
+            self.assertEqual(lookup_cep('01310100').state, 'SP')
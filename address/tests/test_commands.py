@@ -0,0 +1,128 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+
+from geopy.exc import GeocoderServiceError
+
+from address.management.commands.import_addresses import clean_row, init_worker
+from address.models import Address, Country, Locality, State, raw_key, to_python_many
+from address.parser import locality_index
+from address.resolvers import GeocodeResult
+
+from .utils import use_geocoder
+
+
+class FlakyGeocoder(object):
+    """Fails the first `failures` lookups of street number 2."""
+
+    __name__ = 'flaky'
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, address, timeout):
+        with self.lock:
+            self.calls[address.street_number] += 1
+            calls = self.calls[address.street_number]
+        if address.street_number == '2' and calls <= self.failures:
+            raise GeocoderServiceError('down')
+        return GeocodeResult(-23.55, -46.65 + int(address.street_number) / 100.0, 'flaky', 'street')
+
+
+class GeocodeAddressesTestCase(TestCase):
+
+    def setUp(self):
+        self.addresses = to_python_many([
+            {'raw': '%d Rua Augusta' % i, 'street_number': '%d' % i, 'route': 'Rua Augusta', 'locality': '',
+             'country': ''}
+            for i in range(1, 4)
+        ])
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.checkpoint = os.path.join(self.dir, 'checkpoint')
+
+    def geocode_addresses(self):
+        call_command('geocode_addresses', chunk_size=2, workers=2, checkpoint=self.checkpoint,
+                     stdout=StringIO(), stderr=StringIO())
+
+    def test_retry_pass(self):
+        geocoder = use_geocoder(self, FlakyGeocoder(failures=1))
+        self.geocode_addresses()
+        self.assertEqual(Address.objects.filter(location=None).count(), 0)
+        self.assertEqual(geocoder.calls, Counter({'1': 1, '2': 2, '3': 1}))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_checkpoint_before_failure(self):
+        use_geocoder(self, FlakyGeocoder(failures=10))
+        self.geocode_addresses()
+        failed = self.addresses[1]
+        self.assertEqual(list(Address.objects.filter(location=None).values_list('pk', flat=True)), [failed.pk])
+        with open(self.checkpoint) as f:
+            self.assertEqual(int(f.read()), failed.pk - 1)
+
+        # The next run resumes at the failed address.
+        geocoder = use_geocoder(self, FlakyGeocoder(failures=0))
+        self.geocode_addresses()
+        self.assertEqual(geocoder.calls, Counter({'2': 1}))
+        self.assertFalse(Address.objects.filter(location=None).exists())
+
+
+class CleanRowTestCase(TestCase):
+
+    def setUp(self):
+        state = State.objects.create(name='São Paulo', code='SP',
+                                     country=Country.objects.create(name='Brazil', code='BR'))
+        self.campinas = Locality.objects.create(name='Campinas', state=state)
+        init_worker(*locality_index.load())
+        self.addCleanup(locality_index.invalidate)
+
+    def test_parsed(self):
+        raw = 'Rua Barão de Jaguara, 100 - Campinas/SP'
+        value, reason = clean_row({'raw': raw, 'city': 'Campinas', 'state': 'SP'})
+        self.assertIsNone(reason)
+        self.assertEqual(value['raw_key'], raw_key(raw))
+        self.assertEqual(value['parsed'].locality_id, self.campinas.pk)
+        address = to_python_many([value])[0]
+        self.assertEqual((address.route, address.street_number), ('Rua Barão de Jaguara', '100'))
+        self.assertEqual(address.locality_id, self.campinas.pk)
+
+    def test_consistent_not_parsed(self):
+        value, reason = clean_row({'raw': '100 Rua Augusta'})
+        self.assertNotIn('parsed', value)
+
+
+class ImportAddressesTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'addresses.jsonl')
+
+    def test_mixed_file(self):
+        with io.open(self.path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join([
+                json.dumps({'raw': '1 Rua Augusta, São Paulo'}),
+                '{"raw": "2 Rua Augusta"',
+                '[1, 2]',
+                json.dumps({'raw': '3 Rua Augusta', 'latitude': 'north'}),
+                json.dumps({'street_number': '4', 'route': 'Rua Augusta', 'postal_code': '01305-000'}),
+            ]) + '\n')
+        call_command('import_addresses', self.path, chunk_size=2, workers=1, stdout=StringIO())
+
+        self.assertEqual(sorted(Address.objects.values_list('raw', flat=True)),
+                         ['1 Rua Augusta, São Paulo', '4 Rua Augusta, 01305-000'])
+        with io.open(self.path + '.rejected.jsonl', encoding='utf-8') as f:
+            rejected = [json.loads(line) for line in f]
+        self.assertEqual([r['reason'].split(':')[0] for r in rejected],
+                         ['invalid JSON', 'not a JSON object', 'invalid latitude'])
+        self.assertEqual(rejected[0]['row'], '{"raw": "2 Rua Augusta"')
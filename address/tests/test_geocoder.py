@@ -0,0 +1,154 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.test import SimpleTestCase
+
+from geopy.exc import GeocoderServiceError, GeocoderTimedOut
+
+from address.backends import RecordingGeocoder, ReplayGeocoder
+from address.geocoder import CircuitBreaker, CircuitOpenError, GeocoderClient, TokenBucket, make_client
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubNominatim(BaseHTTPRequestHandler):
+    status = 200
+    requests = 0
+
+    def do_GET(self):
+        type(self).requests += 1
+        body = json.dumps([{
+            'lat': '-23.5614', 'lon': '-46.6559', 'display_name': 'Avenida Paulista',
+            'place_id': 1, 'osm_type': 'way', 'osm_id': 1,
+        }]).encode('utf-8')
+        self.send_response(self.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TokenBucketTestCase(SimpleTestCase):
+
+    def test_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=2, clock=clock)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0))
+        clock.now += 1
+        self.assertTrue(bucket.acquire(timeout=0))
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+
+    def test_open_and_half_open(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        clock.now += 10
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        clock.now += 10
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class GeocoderClientTestCase(SimpleTestCase):
+
+    def setUp(self):
+        StubNominatim.status = 200
+        StubNominatim.requests = 0
+        self.server = HTTPServer(('127.0.0.1', 0), StubNominatim)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = GeocoderClient(
+            DOMAIN='127.0.0.1:%d' % self.server.server_port, SCHEME='http',
+            RATE=100, BURST=100, FAILURE_THRESHOLD=2, TIMEOUT=2,
+        )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_geocode(self):
+        location = self.client.geocode('Avenida Paulista, São Paulo')
+        self.assertAlmostEqual(location.latitude, -23.5614)
+        self.assertAlmostEqual(location.longitude, -46.6559)
+
+    def test_circuit_breaker(self):
+        StubNominatim.status = 503
+        for i in range(2):
+            self.assertRaises(GeocoderServiceError, self.client.geocode, 'Rua Augusta')
+        self.assertRaises(CircuitOpenError, self.client.geocode, 'Rua Augusta')
+        self.assertEqual(StubNominatim.requests, 2)
+
+    def test_rate_limit_budget(self):
+        client = GeocoderClient(DOMAIN='127.0.0.1:%d' % self.server.server_port, SCHEME='http', RATE=0.1)
+        client.geocode('Rua Augusta')
+        self.assertRaises(GeocoderTimedOut, client.geocode, 'Rua Augusta', timeout=0.1)
+
+
+class CassetteTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubNominatim)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.dir = tempfile.mkdtemp()
+        self.cassette = os.path.join(self.dir, 'cassette.json')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_record_and_replay(self):
+        recorder = make_client(BACKEND='record', CASSETTE=self.cassette, RATE=100,
+                               DOMAIN='127.0.0.1:%d' % self.server.server_port, SCHEME='http')
+        self.assertIsInstance(recorder, RecordingGeocoder)
+        recorder.geocode({'street': '1 Rua A', 'city': 'São Paulo'}, country_codes=['br'])
+        self.assertFalse(os.path.exists(self.cassette))
+        recorder.flush()
+
+        replay = make_client(BACKEND='replay', CASSETTE=self.cassette)
+        self.assertIsInstance(replay, ReplayGeocoder)
+        location = replay.geocode({'city': 'São Paulo', 'street': '1 Rua A'}, timeout=1, country_codes=['br'])
+        self.assertAlmostEqual(location.latitude, -23.5614)
+        self.assertIsNone(replay.geocode('Somewhere else'))
+
+    def test_record_flush_every(self):
+        recorder = RecordingGeocoder(make_client(RATE=100, DOMAIN='127.0.0.1:%d' % self.server.server_port,
+                                                 SCHEME='http'), self.cassette, flush_every=2)
+        recorder.geocode('1 Rua A')
+        self.assertFalse(os.path.exists(self.cassette))
+        recorder.geocode('2 Rua A')
+        self.assertEqual(len(ReplayGeocoder(self.cassette).responses), 2)
+
+    def test_replay_errors_and_latency(self):
+        with open(self.cassette, 'w') as f:
+            f.write('{}')
+        self.assertRaises(GeocoderTimedOut, ReplayGeocoder(self.cassette, error_rate=1).geocode, 'x')
+        self.assertRaises(GeocoderTimedOut, ReplayGeocoder(self.cassette, latency=0.05).geocode, 'x', timeout=0.01)
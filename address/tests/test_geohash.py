@@ -0,0 +1,34 @@
+from unittest import TestCase
+
+from address.geohash import bounds, encode, merge_cells, neighbours
+
+
+class GeohashTestCase(TestCase):
+
+    def test_encode(self):
+        self.assertEqual(encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(encode(-23.5613, -46.6565), '6gycfqcc2z24')
+        self.assertEqual(encode(None, -46.6565), '')
+
+    def test_prefixes(self):
+        cell = encode(-23.5613, -46.6565)
+        for length in range(1, 12):
+            self.assertEqual(encode(-23.5613, -46.6565, length), cell[:length])
+
+    def test_bounds(self):
+        south, west, north, east = bounds('6gycfq')
+        self.assertTrue(south <= -23.5613 <= north)
+        self.assertTrue(west <= -46.6565 <= east)
+        self.assertRaises(ValueError, bounds, '6gya')
+
+    def test_neighbours(self):
+        cells = neighbours('6gyf')
+        self.assertEqual(len(set(cells)), 8)
+        self.assertNotIn('6gyf', cells)
+        self.assertTrue(all(len(cell) == 4 for cell in cells))
+        # Wraps around the antimeridian and stops at the poles.
+        self.assertIn('z', neighbours('b'))
+        self.assertEqual(len(neighbours('b')), 5)
+
+    def test_merge_cells(self):
+        self.assertEqual(merge_cells(['6GYF4', '6gy', '6gz', '', '6gy']), ['6gy', '6gz'])
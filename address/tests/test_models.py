@@ -1,9 +1,23 @@
-from django.test import TestCase
+import json
+
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.db import IntegrityError
-from django.core.exceptions import ValidationError
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import connection, models
 from django.db.models import Model
 from address.models import *
-from address.models import to_python
+from address.models import AddressManager, canonical_key, to_python, to_python_many, _resolve_hierarchy
+from address.density import rebuild as rebuild_density
+from address.owners import _update_buyers
+from address.regions import refresh_memberships
+from address.signals import buyer_address_changed
+from address.views import HeatmapView
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.gis.geos import MultiPolygon, Point, Polygon
+
+from .utils import StubGeocoder, use_geocoder
 
 # Python 3 fixes.
 import sys
@@ -144,6 +158,34 @@ class AddressTestCase(TestCase):
         self.assertEqual(qs[2].route, '')
         self.assertEqual(qs[3].route, 'Some Street')
 
+    def test_canonical_key(self):
+        self.assertEqual(len(self.ad1.canonical_key), 40)
+        self.assertEqual(self.ad1.canonical_key, self.ad1.make_canonical_key())
+        self.assertEqual(canonical_key('1', 'Rua  Augusta', 5), canonical_key('1', 'RUA AUGUSTA', 5))
+        self.assertNotEqual(canonical_key('1', 'Rua Augusta', 5), canonical_key('1', 'Rua Augusta', 6))
+        self.assertIsNone(canonical_key('', '', 5))
+        # Without a locality the city, or the coordinates, stand in for it.
+        self.assertNotEqual(canonical_key('1', 'Rua Augusta', None, 'São Paulo', 'SP'),
+                            canonical_key('1', 'Rua Augusta', None, 'Rio de Janeiro', 'RJ'))
+        self.assertNotEqual(canonical_key('1', 'Rua Augusta', None, latitude=-23.56, longitude=-46.65),
+                            canonical_key('1', 'Rua Augusta', None, latitude=-22.90, longitude=-43.17))
+        self.assertIsNone(canonical_key('1', 'Rua Augusta', None))
+
+    def test_needs_geocode(self):
+        self.assertTrue(Address(route='Some Street').needs_geocode())
+        ad = Address.objects.get(pk=self.ad1.pk)
+        ad.location = 'POINT(144.96 -37.81)'
+        self.assertFalse(ad.needs_geocode())
+        ad.extra = 'Apt 2'
+        self.assertFalse(ad.needs_geocode())
+        ad.street_number = '2'
+        self.assertTrue(ad.needs_geocode())
+
+    def test_needs_geocode_without_location(self):
+        ad = Address.objects.get(pk=self.ad1.pk)
+        ad.location = None
+        self.assertTrue(ad.needs_geocode())
+
     # def test_unique_street_address_locality(self):
     #     Address.objects.create(street_number='10', route='Other Street', locality=self.au_vic_nco)
     #     self.assertRaises(
@@ -155,6 +197,55 @@ class AddressTestCase(TestCase):
         self.assertEqual(unicode(self.ad1), u'1 Some Street, Melbourne, Victoria 3000, Australia')
         self.assertEqual(unicode(self.ad_empty), u'Northcote, Victoria 3070, Australia')
 
+    def test_display(self):
+        self.assertEqual(self.ad1.display, '1 Some Street, Melbourne, Victoria 3000, Australia')
+        self.assertEqual(self.ad1.formatted, '1 Some Street')
+        ad = Address.objects.get(pk=self.ad1.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(unicode(ad), ad.display)
+
+    def test_display_follows_renames(self):
+        self.au_vic_mel.name = 'Melbourne City'
+        self.au_vic_mel.save()
+        self.au_vic.name = 'Vic'
+        self.au_vic.save()
+        self.assertEqual(Address.objects.get(pk=self.ad1.pk).display, '1 Some Street, Melbourne City, Vic 3000, Australia')
+        # Saving without a change only reads the stored names.
+        state = State.objects.get(pk=self.au_vic.pk)
+        with self.assertNumQueries(2):
+            state.save()
+
+    def test_formatted(self):
+        ad = Address.objects.create(street_number='100', route='Rua Augusta', city='São Paulo', state='SP',
+                                    zip_code='01305000', formatted='Given')
+        self.assertEqual(ad.formatted, 'Given')
+        self.assertEqual(ad.display, '100 Rua Augusta, São Paulo, SP - CEP: 01305-000')
+        ad = Address.objects.get(pk=ad.pk)
+        ad.street_number = '200'
+        ad.save()
+        self.assertEqual(ad.formatted, '200 Rua Augusta, São Paulo, SP - CEP: 01305-000')
+        self.assertEqual(Address.objects.get(pk=ad.pk).display, ad.formatted)
+
+
+class ResolveHierarchyTestCase(TestCase):
+
+    def test_creates_once(self):
+        ids = _resolve_hierarchy('Brasil', 'BR', 'São Paulo', 'SP', 'São Paulo', '01310')
+        self.assertEqual(_resolve_hierarchy('Brasil', 'BR', 'São Paulo', 'SP', 'São Paulo', '01310'), ids)
+        self.assertEqual(Country.objects.get(pk=ids[0]).code, 'BR')
+        self.assertEqual(State.objects.get(pk=ids[1]).country_id, ids[0])
+        self.assertEqual(Locality.objects.get(pk=ids[2]).state_id, ids[1])
+        self.assertEqual(Locality.objects.count(), 1)
+
+    def test_existing_rows(self):
+        br = Country.objects.create(name='Brasil', code='BR')
+        sp = State.objects.create(name='São Paulo', code='SP', country=br)
+        ids = _resolve_hierarchy('Brasil', 'Something else', 'São Paulo', 'SP', 'Campinas', '')
+        self.assertEqual(ids[:2], (br.pk, sp.pk))
+
+    def test_empty(self):
+        self.assertEqual(_resolve_hierarchy('', '', '', '', '', ''), (None, None, None))
+
 
 class AddressFieldTestCase(TestCase):
 
@@ -305,6 +396,12 @@ class AddressFieldTestCase(TestCase):
         self.test.address = to_python(self.ad1_dict['raw'])
         self.assertEqual(self.test.address.raw, self.ad1_dict['raw'])
 
+    def test_assignment_from_string_reuses_address(self):
+        first = to_python(self.ad1_dict['raw'])
+        again = to_python('  1 somewhere street,Northcote, Victoria 3070,  VIC, AU')
+        self.assertEqual(first.pk, again.pk)
+        self.assertEqual(Address.objects.filter(raw_key=first.raw_key).count(), 1)
+
     # def test_save(self):
     #     self.test.address = self.ad1_dict
     #     self.test.save()
@@ -318,3 +415,401 @@ class AddressFieldTestCase(TestCase):
     #     self.assertEqual(test.address.locality.state.code, self.ad1_dict['state_code'])
     #     self.assertEqual(test.address.locality.state.country.name, self.ad1_dict['country'])
     #     self.assertEqual(test.address.locality.state.country.code, self.ad1_dict['country_code'])
+
+
+class ToPythonManyTestCase(TestCase):
+
+    def setUp(self):
+        self.ad1_dict = {
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU',
+            'latitude': -37.77,
+            'longitude': 144.99,
+        }
+        self.ad2_dict = dict(self.ad1_dict, raw='2 Somewhere Street', street_number='2')
+
+    def test_order_and_dedup(self):
+        res = to_python_many([self.ad1_dict, None, self.ad2_dict, 'Someplace', dict(self.ad1_dict)])
+        self.assertEqual(len(res), 5)
+        self.assertIsNone(res[1])
+        self.assertEqual(res[0].street_number, '1')
+        self.assertEqual(res[2].street_number, '2')
+        self.assertEqual(res[3].raw, 'Someplace')
+        self.assertEqual(res[0].pk, res[4].pk)
+        self.assertEqual(res[0].display, '1 Somewhere Street, Northcote, Victoria 3070, Australia')
+        self.assertEqual(res[0].locality_id, res[2].locality_id)
+        self.assertEqual(Locality.objects.count(), 1)
+        self.assertEqual(Address.objects.count(), 3)
+
+    def test_reuses_existing(self):
+        first = to_python_many([self.ad1_dict])[0]
+        again = Address.objects.bulk_from_dicts([self.ad1_dict])[0]
+        self.assertEqual(first.pk, again.pk)
+        self.assertEqual(Address.objects.count(), 1)
+
+    def test_inconsistent_dict(self):
+        res = to_python_many([{'raw': 'Somewhere', 'locality': 'Northcote', 'country': 'Australia'}])
+        self.assertEqual(res[0].raw, 'Somewhere')
+        self.assertEqual(res[0].locality, None)
+
+    def test_raw_strings_are_parsed(self):
+        res = to_python_many(['Rua Augusta, 100 - Consolação, São Paulo/SP, 01305-000', 'Someplace'])
+        self.assertEqual(res[0].route, 'Rua Augusta')
+        self.assertEqual(res[0].street_number, '100')
+        self.assertEqual(res[0].city, 'São Paulo')
+        self.assertEqual(res[0].state, 'SP')
+        self.assertEqual(res[0].zip_code, '01305000')
+        self.assertIsNotNone(res[0].canonical_key)
+        self.assertEqual(res[0].display, '100 Rua Augusta, Consolação, São Paulo, SP - CEP: 01305-000')
+        self.assertEqual(res[1].route, '')
+        self.assertEqual(res[1].display, 'Someplace')
+
+    def test_same_street_in_two_cities(self):
+        # The given coordinates are kept.
+        use_geocoder(self, StubGeocoder(None))
+        value = {'raw': '100 Rua Augusta', 'street_number': '100', 'route': 'Rua Augusta', 'locality': '',
+                 'country': ''}
+        sao_paulo = to_python(dict(value, latitude=-23.5613, longitude=-46.6565))
+        rio = to_python(dict(value, latitude=-22.9068, longitude=-43.1729))
+        self.assertNotEqual(sao_paulo.pk, rio.pk)
+        self.assertEqual((rio.latitude, rio.longitude), (-22.9068, -43.1729))
+        res = to_python_many([dict(value, latitude=-22.9068, longitude=-43.1729),
+                              dict(value, latitude=-23.5613, longitude=-46.6565)])
+        self.assertEqual([a.pk for a in res], [rio.pk, sao_paulo.pk])
+        self.assertEqual(Address.objects.count(), 2)
+
+    def test_invalid_country_code(self):
+        self.assertRaises(ValueError, to_python_many, [dict(self.ad1_dict, country_code='Something else')])
+
+    def test_unkeyed_raw(self):
+        use_geocoder(self, StubGeocoder(None))
+        other = to_python_many(['Someplace'])[0]
+        Address.objects.filter(pk=other.pk).update(raw_key=None)
+        ad = to_python({'raw': '-- , --', 'locality': '', 'country': ''})
+        self.assertNotEqual(ad.pk, other.pk)
+        self.assertEqual(ad.raw, '-- , --')
+        res = to_python_many(['--', '...'])
+        self.assertNotIn(other.pk, [a.pk for a in res])
+        self.assertNotEqual(res[0].pk, res[1].pk)
+
+    def test_geocoded_not_duplicated(self):
+        use_geocoder(self, StubGeocoder((-23.55, -46.65)))
+        value = dict(self.ad1_dict)
+        del value['latitude'], value['longitude']
+        first = to_python(value)
+        self.assertEqual((first.latitude, first.longitude), (-23.55, -46.65))
+        self.assertEqual(to_python(dict(value)).pk, first.pk)
+        self.assertEqual(to_python_many([dict(value)])[0].pk, first.pk)
+        self.assertEqual(Address.objects.count(), 1)
+
+    def test_unnamed_hierarchy(self):
+        country = Country.objects.create(name='', code='')
+        state = State.objects.create(name='', country=country)
+        locality = Locality.objects.create(name='', postal_code='3070', state=state)
+
+        def convert(count):
+            values = [{'raw': 'Place %d' % i, 'street_number': '%d' % i, 'route': 'Rua Augusta', 'locality': '',
+                       'country': '', 'postal_code': '%d' % (3070 + i)} for i in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                res = to_python_many(values)
+            return res, len(queries)
+
+        res, few = convert(2)
+        self.assertEqual([ad.locality_id for ad in res], [locality.pk, None])
+        Address.objects.all().delete()
+        res, many = convert(10)
+        self.assertEqual(few, many)
+
+
+class WithHierarchyTestCase(TestCase):
+
+    def setUp(self):
+        values = []
+        for i in range(10):
+            values.append({
+                'raw': '%d Somewhere Street, Suburb %d, Victoria, AU' % (i, i),
+                'street_number': '%d' % i,
+                'route': 'Somewhere Street',
+                'locality': 'Suburb %d' % i,
+                'postal_code': '30%02d' % i,
+                'state': 'Victoria' if i % 2 else 'New South Wales',
+                'state_code': 'VIC' if i % 2 else 'NSW',
+                'country': 'Australia',
+                'country_code': 'AU',
+            })
+        to_python_many(values)
+
+    def serialize(self, addresses):
+        return [(address.as_dict(), str(address), str(address.locality)) for address in addresses]
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(1):
+            result = self.serialize(Address.objects.with_hierarchy())
+        self.assertEqual(len(result), 10)
+        self.assertEqual(result[1][0]['country'], 'Australia')
+
+    def test_select_hierarchy_manager(self):
+        manager = AddressManager(select_hierarchy=True)
+        manager.model = Address
+        with self.assertNumQueries(1):
+            self.serialize(manager.filter(street_number__in=['1', '2']))
+
+
+class PrefetchHost(models.Model):
+    address = AddressField(blank=True, null=True)
+
+    class Meta:
+        app_label = 'address'
+
+
+class NoPrefetchHost(models.Model):
+    address = AddressField(prefetch=False)
+
+    class Meta:
+        app_label = 'address'
+
+
+class AddressPrefetchTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(AddressPrefetchTestCase, cls).setUpClass()
+        with connection.schema_editor() as editor:
+            editor.create_model(PrefetchHost)
+            editor.create_model(NoPrefetchHost)
+
+    def setUp(self):
+        addresses = to_python_many([{
+            'raw': '%d Somewhere Street, Northcote, Victoria 3070, VIC, AU' % i,
+            'street_number': '%d' % i,
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU',
+        } for i in range(5)])
+        for address in addresses:
+            PrefetchHost.objects.create(address=address)
+            NoPrefetchHost.objects.create(address=address)
+        PrefetchHost.objects.create(address=None)
+
+    def test_batched(self):
+        with self.assertNumQueries(2):
+            result = [host.address and host.address.as_dict() for host in PrefetchHost.objects.all()]
+        self.assertEqual(len(result), 6)
+        self.assertEqual(result[0]['country'], 'Australia')
+        self.assertIsNone(result[5])
+
+    def test_single_instance(self):
+        host = PrefetchHost.objects.exclude(address=None).first()
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(host.address)
+
+    def test_disabled(self):
+        with self.assertNumQueries(6):
+            for host in NoPrefetchHost.objects.all():
+                host.address
+
+    def test_deconstruct(self):
+        self.assertEqual(NoPrefetchHost._meta.get_field('address').deconstruct()[3]['prefetch'], False)
+        self.assertNotIn('prefetch', PrefetchHost._meta.get_field('address').deconstruct()[3])
+
+
+class OwnerLinkTestCase(TestCase):
+
+    def setUp(self):
+        from address import owners
+
+        self.linked = []
+        previous = owners._link
+        owners._link = self.linked.append
+        self.addCleanup(setattr, owners, '_link', previous)
+
+    def test_new_address(self):
+        address = Address.objects.create(raw='Northcote, Victoria')
+        self.assertEqual(self.linked, [[address]])
+
+    def test_unchanged_owner(self):
+        address = Address.objects.create(raw='Northcote, Victoria')
+        address = Address.objects.get(pk=address.pk)
+        address.extra = 'Apt 2'
+        address.save()
+        self.assertEqual(len(self.linked), 1)
+
+    def test_batch(self):
+        res = to_python_many(['Someplace', 'Otherplace'])
+        self.assertEqual(self.linked, [res])
+
+
+class UpdateBuyersTestCase(TestCase):
+
+    def setUp(self):
+        from compramim.users.models import Buyer
+
+        self.users = [get_user_model().objects.create(username='buyer%d' % i) for i in range(3)]
+        self.buyers = [Buyer.objects.get_or_create(user=user)[0] for user in self.users]
+        self.addresses = to_python_many(['Someplace', 'Otherplace'])
+        self.sent = []
+        buyer_address_changed.connect(lambda sender, links, **kwargs: self.sent.append(links), weak=False,
+                                      dispatch_uid='test_update_buyers')
+        self.addCleanup(buyer_address_changed.disconnect, dispatch_uid='test_update_buyers')
+
+    def address_ids(self):
+        return [type(buyer).objects.get(pk=buyer.pk).address_id for buyer in self.buyers]
+
+    def test_batch(self):
+        links = {self.users[0].pk: self.addresses[0].pk, self.users[1].pk: self.addresses[1].pk}
+        _update_buyers(links)
+        self.assertEqual(self.address_ids()[:2], [self.addresses[0].pk, self.addresses[1].pk])
+        self.assertEqual(self.address_ids()[2], self.buyers[2].address_id)
+        self.assertEqual(self.sent, [links])
+
+    def test_single(self):
+        _update_buyers({self.users[2].pk: self.addresses[1].pk})
+        self.assertEqual(self.address_ids()[2], self.addresses[1].pk)
+        self.assertEqual(self.sent, [{self.users[2].pk: self.addresses[1].pk}])
+
+
+def place_addresses(coordinates):
+    """Creates an address at each of the `(latitude, longitude)` pairs."""
+    return to_python_many([
+        {'raw': 'Place %d' % i, 'street_number': '%d' % i, 'route': 'Rua Augusta', 'locality': '',
+         'country': '', 'latitude': latitude, 'longitude': longitude}
+        for i, (latitude, longitude) in enumerate(coordinates)
+    ])
+
+
+# Along a meridian, about 1.1km apart.
+MERIDIAN = [(-23.55 + i * 0.01, -46.65) for i in range(5)]
+
+# Two next to each other in Sao Paulo and one in Rio de Janeiro.
+SAO_PAULO_AND_RIO = [(-23.5613, -46.6565), (-23.5614, -46.6566), (-22.9068, -43.1729)]
+
+
+class NearestTestCase(TestCase):
+
+    def setUp(self):
+        self.addresses = place_addresses(MERIDIAN)
+
+    def test_nearest(self):
+        res = list(Address.objects.nearest((-23.5301, -46.65), k=3))
+        self.assertEqual([a.pk for a in res], [self.addresses[2].pk, self.addresses[1].pk, self.addresses[3].pk])
+        self.assertAlmostEqual(res[0].distance, 11, delta=1)
+        self.assertLess(res[1].distance, res[2].distance)
+
+    def test_nearest_max_distance(self):
+        res = list(Address.objects.nearest(Point(-46.65, -23.55, srid=4326), k=5, max_distance=1500))
+        self.assertEqual([a.pk for a in res], [self.addresses[0].pk, self.addresses[1].pk])
+
+    def test_within_radius(self):
+        res = list(Address.objects.within_radius((-23.53, -46.65), 1200))
+        self.assertEqual(set(a.pk for a in res), set(a.pk for a in self.addresses[1:4]))
+        self.assertEqual(res[0].pk, self.addresses[2].pk)
+
+
+class RegionTestCase(TestCase):
+
+    def setUp(self):
+        self.addresses = place_addresses(MERIDIAN[:4])
+        # Covers the first two addresses.
+        self.region = Region.objects.create(name='Centro', kind='delivery', area=MultiPolygon(
+            Polygon.from_bbox((-46.66, -23.555, -46.64, -23.535)), srid=4326))
+
+    def test_refresh_region(self):
+        # Memberships are refreshed on commit, which TestCase never reaches.
+        self.assertEqual(refresh_memberships(region_ids=[self.region.pk]), 2)
+        self.assertEqual(set(Address.objects.filter(regions=self.region).values_list('pk', flat=True)),
+                         set(a.pk for a in self.addresses[:2]))
+        self.assertEqual(refresh_memberships(region_ids=[self.region.pk]), 2)
+        self.assertEqual(self.region.addresses.count(), 2)
+
+    def test_refresh_addresses(self):
+        refresh_memberships()
+        moved = self.addresses[3]
+        Address.objects.filter(pk=moved.pk).update(location=Point(-46.65, -23.54, srid=4326))
+        self.assertEqual(refresh_memberships(address_ids=[moved.pk]), 1)
+        self.assertEqual(list(moved.regions.all()), [self.region])
+        self.assertEqual(self.region.addresses.count(), 3)
+
+    def test_refresh_both(self):
+        self.assertRaises(ValueError, refresh_memberships, address_ids=[], region_ids=[])
+
+
+class AddressGeohashTestCase(TestCase):
+
+    def setUp(self):
+        self.addresses = place_addresses(SAO_PAULO_AND_RIO)
+
+    def test_stored(self):
+        self.assertEqual(Address.objects.get(pk=self.addresses[0].pk).geohash, '6gycfqcc2z24')
+        # Moving an address moves it to another cell.
+        ad = Address.objects.get(pk=self.addresses[2].pk)
+        ad.latitude, ad.longitude = -23.5614, -46.6566
+        ad.save()
+        self.assertEqual(Address.objects.get(pk=ad.pk).geohash, '6gycfqc8yktw')
+
+    def test_in_cells(self):
+        sao_paulo = set(a.pk for a in self.addresses[:2])
+        self.assertEqual(set(Address.objects.in_cells(['6gycfq']).values_list('pk', flat=True)), sao_paulo)
+        self.assertEqual(Address.objects.in_cells(['6gycfq', '75cm']).count(), 3)
+        self.assertEqual(Address.objects.in_cells(['6gy', '6gycfq']).count(), 2)
+        self.assertEqual(Address.objects.in_cells(['6GYCFQCC']).get().pk, self.addresses[0].pk)
+        self.assertEqual(Address.objects.in_cells([]).count(), 0)
+
+
+class CellDensityTestCase(TestCase):
+
+    def setUp(self):
+        self.addresses = place_addresses(SAO_PAULO_AND_RIO)
+
+    def counts(self, length=4):
+        return dict(CellDensity.objects.filter(length=length, addresses__gt=0).values_list('cell', 'addresses'))
+
+    def test_created(self):
+        self.assertEqual(self.counts(), {'6gyc': 2, '75cm': 1})
+        self.assertEqual(self.counts(7), {'6gycfqc': 2, '75cm9tf': 1})
+
+    def test_moved_and_deleted(self):
+        ad = Address.objects.get(pk=self.addresses[2].pk)
+        ad.latitude, ad.longitude = -23.5615, -46.6567
+        ad.save()
+        self.assertEqual(self.counts(), {'6gyc': 3})
+        Address.objects.get(pk=self.addresses[0].pk).delete()
+        self.assertEqual(self.counts(), {'6gyc': 2})
+
+    def test_rebuild(self):
+        before = dict(CellDensity.objects.values_list('cell', 'addresses'))
+        CellDensity.objects.update(addresses=0)
+        rebuild_density()
+        self.assertEqual(dict(CellDensity.objects.values_list('cell', 'addresses')), before)
+
+    def heatmap(self, user, **params):
+        request = RequestFactory().get('/address/heatmap', params)
+        request.user = user
+        return HeatmapView.as_view()(request)
+
+    def ops_user(self):
+        user = get_user_model().objects.create(username='ops')
+        user.user_permissions.add(Permission.objects.get(content_type__app_label='address',
+                                                         codename='view_celldensity'))
+        return user
+
+    def test_heatmap(self):
+        response = self.heatmap(self.ops_user(), length=5, within='6gy')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([(cell['cell'], cell['addresses']) for cell in data['cells']], [('6gycf', 2)])
+        self.assertFalse(data['truncated'])
+
+    def test_heatmap_permission(self):
+        buyer = get_user_model().objects.create(username='buyer')
+        self.assertRaises(PermissionDenied, self.heatmap, buyer, length=5)
+        self.assertEqual(self.heatmap(self.ops_user(), length=3).status_code, 400)
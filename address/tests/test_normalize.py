@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+from address.normalize import (
+    extract_cep, fold_accents, format_cep, normalize_address, normalize_many, state_name, state_uf,
+)
+
+
+class NormalizeAddressTestCase(TestCase):
+
+    def test_variants(self):
+        for value in ['R. Augusta 100', 'Rua Augusta, 100', 'RUA AUGUSTA 100', 'r augusta - 100']:
+            self.assertEqual(normalize_address(value), 'rua augusta 100')
+
+    def test_abbreviations(self):
+        self.assertEqual(normalize_address('Av. Dr. Arnaldo, 455'), 'avenida doutor arnaldo 455')
+        self.assertEqual(normalize_address('Trav. Sta. Cruz'), 'travessa santa cruz')
+        self.assertEqual(normalize_address('Al. Santos, 12, AL'), 'alameda santos 12 al')
+
+    def test_accents(self):
+        self.assertEqual(fold_accents('São João Conceição'), 'Sao Joao Conceicao')
+        self.assertEqual(normalize_address('Praça da Sé'), 'praca da se')
+
+    def test_empty(self):
+        self.assertEqual(normalize_address(None), '')
+        self.assertEqual(normalize_address(' , '), '')
+
+    def test_normalize_many(self):
+        values = ['R. Augusta 100', 'Rua Augusta, 100', '', 'R. Augusta 100']
+        self.assertEqual(normalize_many(values), ['rua augusta 100', 'rua augusta 100', '', 'rua augusta 100'])
+        self.assertEqual(normalize_many(iter(values[:1])), ['rua augusta 100'])
+
+
+class CepTestCase(TestCase):
+
+    def test_extract(self):
+        self.assertEqual(extract_cep('Rua Augusta, 100 - CEP 01305-000'), '01305000')
+        self.assertEqual(extract_cep('01.305-000'), '01305000')
+        self.assertEqual(extract_cep('123456789'), '')
+        self.assertEqual(extract_cep(None), '')
+
+    def test_format(self):
+        self.assertEqual(format_cep('01305000'), '01305-000')
+        self.assertEqual(format_cep('0130'), '')
+
+
+class StateTestCase(TestCase):
+
+    def test_state_name(self):
+        self.assertEqual(state_name('sp'), 'São Paulo')
+        self.assertEqual(state_name('XX'), '')
+
+    def test_state_uf(self):
+        self.assertEqual(state_uf('Sao  Paulo'), 'SP')
+        self.assertEqual(state_uf('espírito santo'), 'ES')
+        self.assertEqual(state_uf('rj'), 'RJ')
+        self.assertEqual(state_uf('Narnia'), '')
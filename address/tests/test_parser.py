@@ -0,0 +1,99 @@
+from django.test import TestCase
+
+from address.models import Country, Locality, State, to_python_many
+from address.parser import LocalityIndex, locality_index, parse_address, parse_many
+
+
+class ParseAddressTestCase(TestCase):
+
+    def setUp(self):
+        brasil = Country.objects.create(name='Brasil', code='BR')
+        sp = State.objects.create(name='São Paulo', code='SP', country=brasil)
+        rj = State.objects.create(name='Rio de Janeiro', code='RJ', country=brasil)
+        self.sao_paulo = Locality.objects.create(name='São Paulo', state=sp)
+        self.rio = Locality.objects.create(name='Rio de Janeiro', state=rj)
+        self.index = LocalityIndex()
+        # The shared index must not keep the rows rolled back after a test.
+        self.addCleanup(locality_index.invalidate)
+
+    def test_full_address(self):
+        parsed = parse_address('Rua Augusta, 100 - apto 12 - Consolação, São Paulo/SP, CEP 01305-000', self.index)
+        self.assertEqual(parsed.route, 'Rua Augusta')
+        self.assertEqual(parsed.street_number, '100')
+        self.assertEqual(parsed.extra, 'apto 12')
+        self.assertEqual(parsed.neigh, 'Consolação')
+        self.assertEqual(parsed.city, 'São Paulo')
+        self.assertEqual(parsed.state, 'SP')
+        self.assertEqual(parsed.zip_code, '01305000')
+        self.assertEqual(parsed.locality_id, self.sao_paulo.pk)
+        self.assertEqual(parsed.confidence, 1.0)
+
+    def test_known_city_without_state(self):
+        parsed = parse_address('Av. Atlântica nº 1702, Copacabana, rio de janeiro', self.index)
+        self.assertEqual(parsed.route, 'Av. Atlântica')
+        self.assertEqual(parsed.street_number, '1702')
+        self.assertEqual(parsed.neigh, 'Copacabana')
+        self.assertEqual(parsed.city, 'Rio de Janeiro')
+        self.assertEqual(parsed.state, 'RJ')
+        self.assertEqual(parsed.locality_id, self.rio.pk)
+
+    def test_unknown_city(self):
+        parsed = parse_address('Rua 25 de Março, s/n, Centro, Campinas - SP', self.index)
+        self.assertEqual(parsed.route, 'Rua 25 de Março')
+        self.assertEqual(parsed.street_number, 's/n')
+        self.assertEqual(parsed.city, 'Campinas')
+        self.assertIsNone(parsed.locality_id)
+        self.assertLess(parsed.confidence, 1.0)
+
+    def test_low_confidence(self):
+        self.assertLess(parse_address('Someplace', self.index).confidence, 0.5)
+        self.assertEqual(parse_address('', self.index).confidence, 0)
+
+    def test_parse_many(self):
+        parsed = parse_many(['R. Augusta 100, São Paulo - SP', '', 'R. Augusta 100, São Paulo - SP'])
+        self.assertEqual(len(parsed), 3)
+        self.assertEqual(parsed[0].route, 'R. Augusta')
+        self.assertEqual(parsed[0].street_number, '100')
+        self.assertIs(parsed[0], parsed[2])
+
+    def test_as_fields(self):
+        fields = parse_address('Rua %s, 1, São Paulo/SP' % ('A' * 150), self.index).as_fields()
+        self.assertEqual(len(fields['route']), 100)
+        self.assertIsNone(fields['extra'])
+        self.assertEqual(fields['locality_id'], self.sao_paulo.pk)
+
+    def test_index_updates(self):
+        self.index.load()
+        campinas = Locality.objects.create(name='Campinas', state=self.sao_paulo.state)
+        self.assertIsNone(self.index.get('Campinas', 'SP'))
+        self.index._add_committed([(campinas.pk, campinas.name, campinas.state_id)])
+        self.assertEqual(self.index.get('campinas', 'SP')[0], campinas.pk)
+        self.index.invalidate()
+        self.assertEqual(self.index.get('Rio de Janeiro')[0], self.rio.pk)
+
+    def test_invalidated_while_loading(self):
+        index = self.index
+
+        class Racing(LocalityIndex):
+            def load(self):
+                loaded = super(Racing, self).load()
+                index.invalidate()
+                return loaded
+
+        index.__class__ = Racing
+        self.assertEqual(index.get('São Paulo', 'SP')[0], self.sao_paulo.pk)
+
+    def test_bulk_created_localities(self):
+        # Localities created without `post_save` are handed to the index.
+        added = []
+        locality_index.add_many = lambda rows: added.extend(rows)
+        self.addCleanup(delattr, locality_index, 'add_many')
+        ad = to_python_many([{
+            'raw': '1 Rua A, Campinas', 'street_number': '1', 'route': 'Rua A', 'locality': 'Campinas',
+            'state': 'São Paulo', 'state_code': 'SP', 'country': 'Brasil', 'country_code': 'BR',
+        }])[0]
+        self.assertIn((ad.locality_id, 'Campinas', ad.locality.state_id), added)
+
+        self.index.load()
+        self.index._add_committed(added)
+        self.assertEqual(self.index.get('Campinas', 'SP')[0], ad.locality_id)
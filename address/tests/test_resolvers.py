@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, TestCase
+
+from geopy.exc import GeocoderTimedOut
+
+from address import geocoder
+from address.backends import ReplayGeocoder, cassette_key
+from address.cache import geocode_cache
+from address.models import Address, Country, Locality, State
+from address.resolvers import GeocodeResult, locality_centroid, resolve, structured
+
+
+def nothing(address, timeout):
+    return None
+
+
+def street(address, timeout):
+    return GeocodeResult(1.0, 2.0, 'street', 'street')
+
+
+def locality(address, timeout):
+    return GeocodeResult(3.0, 4.0, 'locality', 'locality')
+
+
+def broken(address, timeout):
+    raise GeocoderTimedOut('too slow')
+
+
+class ResolveTestCase(SimpleTestCase):
+
+    def test_first_answer_wins(self):
+        result = resolve(None, [(nothing, None), (street, 1), (locality, 1)])
+        self.assertEqual(result.stage, 'street')
+        self.assertEqual((result.latitude, result.longitude), (1.0, 2.0))
+
+    def test_error_falls_through(self):
+        result = resolve(None, [(broken, 1), (locality, 1)])
+        self.assertEqual(result.precision, 'locality')
+
+    def test_error_raised_without_answer(self):
+        self.assertRaises(GeocoderTimedOut, resolve, None, [(broken, 1), (nothing, 1)])
+
+    def test_no_answer(self):
+        self.assertIsNone(resolve(None, [(nothing, 1)]))
+
+
+class LocalityStagesTestCase(TestCase):
+
+    def setUp(self):
+        state = State.objects.create(name='São Paulo', code='SP',
+                                     country=Country.objects.create(name='Brazil', code='BR'))
+        self.address = Address(street_number='100', route='Rua Barão de Jaguara',
+                               locality=Locality.objects.create(name='Campinas', postal_code='13015', state=state))
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        cassette = os.path.join(self.dir, 'cassette.json')
+        answers = [
+            ({'street': '100 Rua Barão de Jaguara', 'city': 'Campinas', 'state': 'São Paulo',
+              'postalcode': '13015', 'country': 'Brasil'}, (-22.9056, -47.0608)),
+            ({'city': 'Campinas', 'state': 'São Paulo', 'country': 'Brasil'}, (-22.9099, -47.0626)),
+        ]
+        with open(cassette, 'w', encoding='utf-8') as f:
+            json.dump(dict((cassette_key(query, {'country_codes': ['br']}),
+                            dict(address='', latitude=lat, longitude=lng, raw={}))
+                           for query, (lat, lng) in answers), f)
+        geocoder._client = ReplayGeocoder(cassette)
+        self.addCleanup(setattr, geocoder, '_client', None)
+        geocode_cache.clear()
+        self.addCleanup(geocode_cache.clear)
+
+    def test_structured_uses_locality(self):
+        result = structured(self.address, 1)
+        self.assertEqual((result.latitude, result.longitude), (-22.9056, -47.0608))
+
+    def test_locality_centroid_uses_locality(self):
+        result = locality_centroid(self.address, 1)
+        self.assertEqual((result.latitude, result.longitude), (-22.9099, -47.0626))
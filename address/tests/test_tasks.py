@@ -0,0 +1,97 @@
+import threading
+
+from django.test import TestCase, TransactionTestCase
+
+from geopy.exc import GeocoderServiceError
+
+from address.models import Address, to_python_many
+from address.signals import address_geocoded
+from address.tasks import _run, geocode_address, schedule_geocode
+
+from .utils import StubGeocoder, use_geocoder
+
+
+def pending_address():
+    address = to_python_many([{
+        'raw': '100 Rua Augusta, São Paulo', 'street_number': '100', 'route': 'Rua Augusta',
+        'locality': '', 'country': '',
+    }])[0]
+    Address.objects.filter(pk=address.pk).update(geocode_pending=True)
+    return address
+
+
+class GeocodeAddressTestCase(TestCase):
+
+    def setUp(self):
+        self.address = pending_address()
+        self.sent = []
+        receiver = lambda sender, instance, success, **kwargs: self.sent.append((instance.pk, success))
+        address_geocoded.connect(receiver, weak=False, dispatch_uid='test_tasks')
+        self.addCleanup(address_geocoded.disconnect, dispatch_uid='test_tasks')
+
+    def test_retried(self):
+        geocoder = use_geocoder(self, StubGeocoder(GeocoderServiceError('down'), GeocoderServiceError('down'),
+                                                   (-23.55, -46.65)))
+        self.assertTrue(geocode_address(self.address.pk, retries=3, backoff=0))
+        self.assertEqual(len(geocoder.calls), 3)
+        ad = Address.objects.get(pk=self.address.pk)
+        self.assertEqual((ad.latitude, ad.longitude), (-23.55, -46.65))
+        self.assertEqual((ad.location.y, ad.location.x), (-23.55, -46.65))
+        self.assertFalse(ad.geocode_pending)
+        self.assertEqual(self.sent, [(self.address.pk, True)])
+
+    def test_gives_up(self):
+        geocoder = use_geocoder(self, StubGeocoder(GeocoderServiceError('down')))
+        self.assertFalse(geocode_address(self.address.pk, retries=2, backoff=0))
+        self.assertEqual(len(geocoder.calls), 3)
+        ad = Address.objects.get(pk=self.address.pk)
+        self.assertIsNone(ad.location)
+        self.assertFalse(ad.geocode_pending)
+        self.assertEqual(self.sent, [(self.address.pk, False)])
+
+    def test_edited_meanwhile(self):
+        geocoder = StubGeocoder((-23.55, -46.65))
+
+        def edit_then_answer(address, timeout):
+            Address.objects.filter(pk=address.pk).update(street_number='200')
+            return geocoder(address, timeout)
+        edit_then_answer.__name__ = 'edit_then_answer'
+        use_geocoder(self, edit_then_answer)
+        self.assertFalse(geocode_address(self.address.pk, retries=0))
+        ad = Address.objects.get(pk=self.address.pk)
+        self.assertIsNone(ad.latitude)
+        self.assertTrue(ad.geocode_pending)
+        self.assertEqual(self.sent, [])
+
+    def test_already_geocoded(self):
+        geocoder = use_geocoder(self, StubGeocoder((-23.55, -46.65)))
+        Address.objects.filter(pk=self.address.pk).update(geocode_pending=False)
+        self.assertFalse(geocode_address(self.address.pk))
+        self.assertEqual(geocoder.calls, [])
+
+    def test_vanished(self):
+        use_geocoder(self, StubGeocoder((-23.55, -46.65)))
+        self.assertFalse(geocode_address(0))
+        self.assertEqual(self.sent, [])
+
+
+class ScheduleGeocodeTestCase(TransactionTestCase):
+
+    def test_runs_in_background(self):
+        use_geocoder(self, StubGeocoder((-23.55, -46.65)))
+        address = pending_address()
+        done = threading.Event()
+        address_geocoded.connect(lambda sender, **kwargs: done.set(), weak=False, dispatch_uid='test_tasks')
+        self.addCleanup(address_geocoded.disconnect, dispatch_uid='test_tasks')
+
+        # Outside a transaction, on_commit callbacks run straight away.
+        schedule_geocode(address.pk)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(Address.objects.get(pk=address.pk).latitude, -23.55)
+
+    def test_errors_are_logged(self):
+        use_geocoder(self, StubGeocoder(ValueError('bug')))
+        address = pending_address()
+        with self.assertLogs('address.tasks', 'ERROR'):
+            # `_run` catches the error, so the worker stays usable.
+            _run(address.pk)
@@ -0,0 +1,28 @@
+from address import resolvers
+from address.resolvers import GeocodeResult
+
+
+class StubGeocoder(object):
+    """A geocoding stage answering from `answers` in turn: `(lat, lng)`
+    pairs, None for no answer, or exceptions to raise. The last answer is
+    repeated. Records the addresses it was called with in `calls`."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = []
+        self.__name__ = 'stub'
+
+    def __call__(self, address, timeout):
+        self.calls.append(address)
+        answer = self.answers[min(len(self.calls), len(self.answers)) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        if answer is not None:
+            return GeocodeResult(answer[0], answer[1], 'stub', resolvers.STREET)
+
+
+def use_geocoder(testcase, geocoder):
+    """Makes `geocoder` the only geocoding stage for the rest of the test."""
+    resolvers._stages = [(geocoder, None)]
+    testcase.addCleanup(setattr, resolvers, '_stages', None)
+    return geocoder
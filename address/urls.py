@@ -12,4 +12,14 @@ urlpatterns = [
         view=views.AddressCreateView.as_view(),
         name='address-create-view'
     ),
+    re_path(
+        r'^address/cep/(?P<cep>[0-9-]{8,9})$',
+        view=views.CepLookupView.as_view(),
+        name='cep-lookup-view'
+    ),
+    re_path(
+        r'^address/heatmap$',
+        view=views.HeatmapView.as_view(),
+        name='heatmap-view'
+    ),
 ]
@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
 
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.http import Http404, JsonResponse
 from django.urls import reverse
 from django.views.generic import (
     ListView, UpdateView, CreateView, DetailView,
     TemplateView, FormView, View
     )
 
-from .models import Address
+from .cep import lookup_cep
+from .density import LENGTHS
+from .geohash import bounds
+from .models import Address, CellDensity
 from . import forms
 
 
@@ -26,3 +30,55 @@ class AddressCreateView(LoginRequiredMixin, CreateView):
 
     def get_success_url(self):
         return reverse('users:address_update')
+
+
+class CepLookupView(View):
+    """Answers CEP lookups from the offline index in the same shape as viacep."""
+
+    def get(self, request, cep):
+        record = lookup_cep(cep)
+        if record is None:
+            raise Http404('CEP not found')
+        return JsonResponse(dict(
+            cep=record.cep,
+            logradouro=record.street,
+            bairro=record.neigh,
+            localidade=record.city,
+            uf=record.state,
+            latitude=record.latitude,
+            longitude=record.longitude,
+        ))
+
+
+class HeatmapView(PermissionRequiredMixin, View):
+    """Returns the address counts of the cells of one geohash length, from
+    `CellDensity`. Takes `length` (one of `ADDRESS_DENSITY_LENGTHS`, the
+    shortest by default) and optionally `within`, a shorter cell to limit
+    the result to. Only for users allowed to view `CellDensity`."""
+
+    permission_required = 'address.view_celldensity'
+    max_cells = 10000
+
+    def get(self, request):
+        try:
+            length = int(request.GET.get('length', LENGTHS[0]))
+        except ValueError:
+            length = None
+        within = request.GET.get('within', '').lower()
+        if length not in LENGTHS or len(within) >= length:
+            return JsonResponse(dict(error='Invalid length', lengths=LENGTHS), status=400)
+
+        rows = CellDensity.objects.filter(length=length, addresses__gt=0)
+        if within:
+            rows = rows.filter(cell__startswith=within)
+        rows = list(rows.values_list('cell', 'addresses', 'owned')[:self.max_cells + 1])
+        cells = []
+        for cell, addresses, owned in rows[:self.max_cells]:
+            try:
+                south, west, north, east = bounds(cell)
+            except ValueError:
+                continue
+            cells.append(dict(cell=cell, south=south, west=west, north=north, east=east,
+                              addresses=addresses, owned=owned))
+        return JsonResponse(dict(length=length, within=within, cells=cells,
+                                 truncated=len(rows) > self.max_cells))
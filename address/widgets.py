@@ -66,8 +66,7 @@ class AddressWidget(forms.TextInput):
         elif isinstance(value, dict):
             ad = value
         elif isinstance(value, (int, long)):
-            ad = Address.objects.get(pk=value)
-            ad = ad.as_dict()
+            ad = Address.objects.get_cached(value)
         else:
             ad = value.as_dict()
 